@@ -0,0 +1,24 @@
+#!flask/bin/python
+import gzip
+import mimetypes
+import os
+from bookstore import create_app
+app = create_app()
+from bookstore.httpcache import brotli, compressible
+count = 0
+for root, dirs, files in os.walk(app.static_folder):
+    for name in files:
+        path = os.path.join(root, name)
+        if name.endswith(('.gz', '.br')) or not compressible(mimetypes.guess_type(name)[0]):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            continue
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, 9))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+        count += 1
+print('Precompressed static files: ' + str(count))
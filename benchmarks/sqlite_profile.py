@@ -0,0 +1,108 @@
+"""Concurrent read throughput on SQLite under a steady write load.
+
+Compares the default connection settings with the production profile
+from config.py. Uses only the standard library, so it runs anywhere:
+
+    python benchmarks/sqlite_profile.py --readers 8 --seconds 5
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def production_pragmas():
+    import config
+    return config.ENVIRONMENTS['production']()['SQLITE_PRAGMAS']
+
+
+def connect(path, pragmas):
+    conn = sqlite3.connect(path, timeout=pragmas.get('busy_timeout', 5000) / 1000.0,
+                           check_same_thread=False)
+    for name, value in pragmas.items():
+        conn.execute('PRAGMA %s = %s' % (name, value))
+    return conn
+
+
+def seed(path, books):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE book (id INTEGER PRIMARY KEY, book VARCHAR(30), price INTEGER)')
+    conn.execute('CREATE TABLE "order" (id INTEGER PRIMARY KEY, book_id INTEGER, price INTEGER)')
+    conn.executemany('INSERT INTO book (book, price) VALUES (?, ?)',
+                     (('book %d' % i, i * 100) for i in range(books)))
+    conn.commit()
+    conn.close()
+
+
+def run(pragmas, readers, seconds, books):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        seed(path, books)
+        stop = threading.Event()
+        reads = [0] * readers
+        writes = [0]
+        errors = [0]
+
+        def reader(slot):
+            conn = connect(path, pragmas)
+            i = 0
+            while not stop.is_set():
+                try:
+                    conn.execute('SELECT id, book, price FROM book WHERE id > ? ORDER BY id LIMIT 24',
+                                 (i % books,)).fetchall()
+                    reads[slot] += 1
+                except sqlite3.OperationalError:
+                    errors[0] += 1
+                i += 97
+            conn.close()
+
+        def writer():
+            conn = connect(path, pragmas)
+            while not stop.is_set():
+                try:
+                    conn.execute('INSERT INTO "order" (book_id, price) VALUES (1, 100)')
+                    conn.commit()
+                    writes[0] += 1
+                except sqlite3.OperationalError:
+                    errors[0] += 1
+            conn.close()
+
+        threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(readers)]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return dict(reads_per_second=sum(reads) / seconds,
+                    writes_per_second=writes[0] / seconds,
+                    errors=errors[0])
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--books', type=int, default=10000)
+    args = parser.parse_args()
+    results = {
+        'default': run({'busy_timeout': 5000}, args.readers, args.seconds, args.books),
+        'production': run(production_pragmas(), args.readers, args.seconds, args.books),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
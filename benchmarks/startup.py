@@ -0,0 +1,47 @@
+"""Cold start: time from interpreter start to a ready app, measured in
+fresh processes so nothing is warm from a previous run.
+
+    python benchmarks/startup.py --runs 10 --target 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, time
+start = time.time()
+from bookstore import create_app
+app = create_app(%r)
+from bookstore import metrics
+app.test_client()
+print(json.dumps(dict(total=time.time() - start, startup=metrics.startup_seconds)))
+'''
+
+
+def measure(environment):
+    output = subprocess.check_output([sys.executable, '-c', PROBE % environment], cwd=ROOT)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure app cold start.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--environment', default='production')
+    parser.add_argument('--target', type=float, help='fail if the median exceeds this many seconds')
+    args = parser.parse_args()
+
+    totals = sorted(measure(args.environment)['total'] for _ in range(args.runs))
+    result = dict(runs=args.runs, median_s=round(statistics.median(totals), 4),
+                  min_s=round(totals[0], 4), max_s=round(totals[-1], 4), target_s=args.target)
+    print(json.dumps(result, indent=2))
+    if args.target is not None and result['median_s'] > args.target:
+        sys.exit('cold start %.3fs is over the %.3fs target' % (result['median_s'], args.target))
+
+
+if __name__ == '__main__':
+    main()
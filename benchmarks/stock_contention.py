@@ -0,0 +1,104 @@
+"""Flash-sale stress run: many buyers add the same book to their carts and
+check out concurrently. Exits non-zero if more copies were sold or held
+than were in stock.
+
+    python benchmarks/stock_contention.py --stock 100 --buyers 32 --attempts 20
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storefront import configure
+
+
+def seed(app, stock, buyers):
+    from bookstore import db
+    from bookstore.models import Book, User
+    with app.app_context():
+        db.create_all()
+        book = Book.create(book='Flash sale', type='novel', description='', price=10000, stock=stock)
+        users = [User.create(username='buyer%d' % i, email='buyer%d@example.com' % i,
+                             password='buyer', number='0') for i in range(buyers)]
+        ids = book.id, [(user.username, user.email) for user in users]
+        db.session.remove()
+    return ids
+
+
+def buyer(app, account, book_id, attempts, results, lock):
+    client = app.test_client()
+    client.post('/login', data=dict(name=account[0], email=account[1], password='buyer'))
+    counts = dict(added=0, refused=0, checkouts=0, errors=0, latencies=[])
+    for _ in range(attempts):
+        start = time.time()
+        response = client.get('/books/buy/%d' % book_id)
+        counts['latencies'].append(time.time() - start)
+        if response.status_code >= 500:
+            counts['errors'] += 1
+            continue
+        page = client.get('/cart').get_data(as_text=True)
+        if 'Flash sale</a>' in page:
+            counts['added'] += 1
+        else:
+            counts['refused'] += 1
+        if client.get('/work').status_code >= 500:
+            counts['errors'] += 1
+        else:
+            counts['checkouts'] += 1
+    with lock:
+        results.append(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent buy_book stress run.')
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--buyers', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=20, help='purchases per buyer')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bookstore-stock-')
+    try:
+        app = configure(workdir)
+        book_id, accounts = seed(app, args.stock, args.buyers)
+        results, lock = [], threading.Lock()
+        threads = [threading.Thread(target=buyer, args=(app, account, book_id, args.attempts, results, lock))
+                   for account in accounts]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        from bookstore import db
+        from bookstore.models import Book, Order, Reservation
+        with app.app_context():
+            remaining = db.session.query(Book.stock).filter(Book.id == book_id).scalar()
+            sold = db.session.query(db.func.coalesce(db.func.sum(Order.quantity), 0)).filter(
+                Order.book_id == book_id).scalar()
+            held = db.session.query(db.func.coalesce(db.func.sum(Reservation.quantity), 0)).filter(
+                Reservation.book_id == book_id).scalar()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = sorted(l for counts in results for l in counts['latencies'])
+    summary = dict(stock=args.stock, sold=sold, held=held, remaining=remaining,
+                   errors=sum(counts['errors'] for counts in results),
+                   refused=sum(counts['refused'] for counts in results),
+                   buy_requests=len(latencies),
+                   buy_p50_ms=round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+                   buy_p99_ms=round(latencies[int(len(latencies) * 0.99)] * 1000, 3) if latencies else None,
+                   throughput_rps=round(3 * len(latencies) / elapsed, 1) if elapsed else None)
+    print(json.dumps(summary, indent=2))
+    if remaining < 0 or sold + held + remaining != args.stock:
+        sys.exit('oversold: %d sold + %d held + %d left != %d in stock' % (sold, held, remaining, args.stock))
+
+
+if __name__ == '__main__':
+    main()
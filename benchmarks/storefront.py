@@ -0,0 +1,261 @@
+"""Storefront load test: seeds a synthetic catalog into a temporary SQLite
+database and search index, then drives the main pages through the Flask
+test client and a threaded WSGI server.
+
+    python benchmarks/storefront.py --books 20000 --requests 300 --output results.json
+    python benchmarks/storefront.py --compare results.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ['war', 'peace', 'night', 'river', 'garden', 'winter', 'city', 'master', 'idiot',
+         'island', 'storm', 'letter', 'mirror', 'silver', 'forest', 'journey', 'shadow']
+
+USER = dict(username='bench', email='bench@example.com', password='bench', number='0')
+
+
+def configure(workdir):
+    from bookstore import create_app
+    return create_app(
+        'testing',
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'bench.db'),
+        WHOOSH_BASE=os.path.join(workdir, 'whoosh_index'),
+        IMAGE_STORE=os.path.join(workdir, 'covers'),
+        TASK_DATABASE=os.path.join(workdir, 'tasks.db'),
+        ARCHIVE_DATABASE=os.path.join(workdir, 'archive.db'),
+        QUERY_BUDGET=None,
+    )
+
+
+def cover_bytes(size, seed):
+    rng = random.Random(seed)
+    try:
+        import io
+        from PIL import Image
+        image = Image.new('RGB', (600, 900), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        out = io.BytesIO()
+        image.save(out, format='PNG')
+        data = out.getvalue()
+        if len(data) >= size:
+            return data
+    except ImportError:
+        data = b'\x89PNG\r\n\x1a\n'
+    return data + bytes(rng.randrange(256) for _ in range(size - len(data)))
+
+
+def seed(app, books, authors, orders, cover_size, distinct_covers, batch_size=1000):
+    from bookstore import db, search
+    from bookstore.images import cover_fields
+    from bookstore.models import Book, Author, Association, User, Order, OrderStatus
+    rng = random.Random(42)
+    with app.app_context():
+        db.create_all()
+        covers = [cover_fields(cover_bytes(cover_size, i)) for i in range(distinct_covers)]
+        db.session.execute(Author.__table__.insert(),
+                           [dict(id=i, name='%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS).title(), i))
+                            for i in range(1, authors + 1)])
+        for start in range(1, books + 1, batch_size):
+            ids = range(start, min(start + batch_size, books + 1))
+            rows, links = [], []
+            for id in ids:
+                row = dict(id=id,
+                           book=' '.join(rng.choice(WORDS) for _ in range(3)).capitalize(),
+                           type=rng.choice(['novel', 'poetry', 'history', 'science']),
+                           description=' '.join(rng.choice(WORDS) for _ in range(20)),
+                           price=rng.randrange(100, 5000) * 100,
+                           image=None)
+                row.update(covers[id % distinct_covers])
+                rows.append(row)
+                links.append(dict(books=id, authors=rng.randrange(1, authors + 1)))
+            db.session.execute(Book.__table__.insert(), rows)
+            db.session.execute(Association.__table__.insert(), links)
+            db.session.commit()
+        user = User.create(**USER)
+        db.session.execute(Order.__table__.insert(),
+                           [dict(user_id=user.id, book_id=rng.randrange(1, books + 1),
+                                 price=10000, status=rng.choice(list(OrderStatus)))
+                            for _ in range(orders)])
+        db.session.commit()
+        search.rebuild()
+        db.session.remove()
+
+
+def scenarios(books):
+    rng = random.Random(7)
+    return [
+        ('books', False, lambda: '/books'),
+        ('book_detail', False, lambda: '/books/%d' % rng.randrange(1, books + 1)),
+        ('book_image', False, lambda: '/store/%d/image?size=thumb' % rng.randrange(1, books + 1)),
+        ('search', False, lambda: '/search?q=%s' % rng.choice(WORDS)),
+        ('cart', True, lambda: '/cart'),
+        ('buy_book', True, lambda: '/books/buy/%d' % rng.randrange(1, books + 1)),
+        ('work', True, lambda: '/work'),
+    ]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+    return dict(requests=len(latencies),
+                errors=errors,
+                p50_ms=round(pick(0.50) * 1000, 3) if latencies else None,
+                p99_ms=round(pick(0.99) * 1000, 3) if latencies else None,
+                throughput_rps=round(len(latencies) / elapsed, 1) if elapsed else None)
+
+
+def run_client(app, paths, requests):
+    client = app.test_client()
+    client.post('/login', data=dict(name=USER['username'], email=USER['email'],
+                                    password=USER['password']))
+    results = {}
+    for name, _, path in paths:
+        latencies, errors = [], 0
+        started = time.time()
+        for _ in range(requests):
+            start = time.time()
+            response = client.get(path())
+            latencies.append(time.time() - start)
+            if response.status_code >= 400:
+                errors += 1
+        results[name] = summarize(latencies, time.time() - started, errors)
+    return results
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def login_opener(base):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                         NoRedirect())
+    data = urllib.parse.urlencode(dict(name=USER['username'], email=USER['email'],
+                                       password=USER['password'])).encode('ascii')
+    try:
+        opener.open(base + '/login', data)
+    except urllib.error.HTTPError:
+        pass
+    return opener
+
+
+def run_server(app, paths, requests, concurrency):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+
+        def log_request(self, *args, **kwargs):
+            pass
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+    results = {}
+    try:
+        for name, _, path in paths:
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+            per_worker = max(1, requests // concurrency)
+
+            def worker():
+                opener = login_opener(base)
+                for _ in range(per_worker):
+                    start = time.time()
+                    try:
+                        opener.open(base + path()).read()
+                        failed = False
+                    except urllib.error.HTTPError as e:
+                        failed = e.code >= 400
+                    except OSError:
+                        failed = True
+                    elapsed = time.time() - start
+                    with lock:
+                        latencies.append(elapsed)
+                        errors[0] += failed
+            workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+            started = time.time()
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            results[name] = summarize(latencies, time.time() - started, errors[0])
+    finally:
+        server.shutdown()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    for mode in ('client', 'server'):
+        for name, now in sorted(current[mode].items()):
+            before = baseline.get(mode, {}).get(name)
+            if not before or not before.get('p50_ms') or not now.get('p50_ms'):
+                continue
+            print('%-7s %-12s p50 %8.2f -> %8.2f ms (%+.0f%%)   p99 %8.2f -> %8.2f ms'
+                  % (mode, name, before['p50_ms'], now['p50_ms'],
+                     100.0 * (now['p50_ms'] - before['p50_ms']) / before['p50_ms'],
+                     before['p99_ms'], now['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Storefront load test.')
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--authors', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--cover-size', type=int, default=50000, help='bytes per cover')
+    parser.add_argument('--distinct-covers', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200, help='per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--compare', help='baseline results JSON to diff against')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+    try:
+        app = configure(workdir)
+        started = time.time()
+        seed(app, args.books, args.authors, args.orders, args.cover_size, args.distinct_covers)
+        seed_seconds = time.time() - started
+        paths = scenarios(args.books)
+        results = dict(
+            meta=dict(commit=git_commit(), timestamp=time.time(), seed_seconds=round(seed_seconds, 2),
+                      params=vars(args)),
+            client=run_client(app, paths, args.requests),
+            server=run_server(app, paths, args.requests, args.concurrency),
+            peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
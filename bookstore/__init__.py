@@ -1,9 +1,12 @@
+import time
+started = time.time()
+
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 import os
 from config import basedir
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
+from .database import SQLAlchemy
 
 
 app = Flask(__name__, static_url_path='/static')
@@ -13,4 +16,20 @@ login_manager = LoginManager(app)
 login_manager.session_protection = 'strong'
 login_manager.login_view = 'auth.login'
 app.config.from_object('config')
-from bookstore import views, models
+
+
+def create_app(environment=None, **settings):
+    # Views, models and their signal handlers are imported here rather than
+    # at package import, after the environment's settings are in place:
+    # caches and stores read app.config when their modules load.
+    environment = environment or os.environ.get('BOOKSTORE_ENV', 'development')
+    if environment not in app.config['ENVIRONMENTS']:
+        raise ValueError('unknown environment %r, expected one of: %s'
+                         % (environment, ', '.join(sorted(app.config['ENVIRONMENTS']))))
+    overrides = app.config['ENVIRONMENTS'][environment]
+    app.config.update(overrides() if callable(overrides) else overrides)
+    app.config.update(settings, ENVIRONMENT=environment)
+    from bookstore import views, models, querycount, metrics, api
+    metrics.startup_seconds = time.time() - started
+    app.logger.info('bookstore (%s) started in %.3fs', environment, metrics.startup_seconds)
+    return app
@@ -0,0 +1,236 @@
+from collections import OrderedDict
+from flask import request, url_for, jsonify, abort
+from flask_login import current_user
+from bookstore import app, db
+from .models import Book, Author, Association, Order, OrderStatus
+from .pagination import keyset_paginate, InvalidCursor
+from .httpcache import conditional
+from . import search as catalog_search
+
+API = '/api/v1'
+
+
+def error(status, message):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+def id_list(value):
+    try:
+        ids = [int(id) for id in value.split(',') if id.strip()]
+    except ValueError:
+        abort(error(400, 'ids must be comma-separated integers'))
+    if len(ids) > app.config['API_MAX_BATCH']:
+        abort(error(400, 'at most %d ids per request' % app.config['API_MAX_BATCH']))
+    return ids
+
+
+def linked(left, right, ids):
+    # Association stores ids as strings; one query for the whole page.
+    found = {}
+    if ids:
+        for a, b in db.session.query(left, right).filter(left.in_([str(id) for id in ids])):
+            found.setdefault(int(a), []).append(int(b))
+    return found
+
+
+def cover(size):
+    column = Book.thumb_hash if size == 'thumb' else Book.image_hash
+
+    def value(row):
+        digest = row[column.key]
+        if digest is None:
+            return None
+        return url_for('book_image', id=row['id'], size=size, v=digest[:12], _external=True)
+    return (column,), value
+
+
+def field(column, convert=None):
+    return (column,), lambda row: convert(row[column.key]) if convert else row[column.key]
+
+
+class Resource():
+    # Each requested field names the columns it needs, so a request becomes a
+    # single column-tuple query and rows are never loaded as ORM instances.
+
+    def __init__(self, model, fields, default, links=None, sorts=None):
+        self.model = model
+        self.fields = fields
+        self.default = default
+        self.links = links or {}
+        self.sorts = sorts or {'id': model.id}
+
+    def fieldset(self):
+        requested = request.args.get('fields')
+        if not requested:
+            return self.default
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields and name not in self.links]
+        if unknown:
+            abort(error(400, 'unknown fields: ' + ', '.join(unknown)))
+        return names
+
+    def query(self, names, *extra):
+        columns = OrderedDict([('id', self.model.id)])
+        for column in extra:
+            columns[column.key] = column
+        for name in names:
+            for column in self.fields.get(name, ((),))[0]:
+                columns[column.key] = column
+        return db.session.query(*columns.values())
+
+    def serialize(self, rows, names):
+        rows = [row._asdict() for row in rows]
+        links = dict((name, linked(*self.links[name], [row['id'] for row in rows]))
+                     for name in names if name in self.links)
+        items = []
+        for row in rows:
+            item = OrderedDict()
+            for name in names:
+                if name in links:
+                    item[name] = links[name].get(row['id'], [])
+                else:
+                    item[name] = self.fields[name][1](row)
+            items.append(item)
+        return items
+
+    def collection(self, query=None):
+        names = self.fieldset()
+        if query is None:
+            query = self.query(names, *self.sorts.values())
+        if 'ids' in request.args:
+            ids = id_list(request.args['ids'])
+            rows = query.filter(self.model.id.in_(ids)).all()
+            items = dict((item['id'], item) for item in self.serialize(rows, ['id'] + names))
+            return jsonify(items=[strip(items[id], names) for id in ids if id in items],
+                           missing=[id for id in ids if id not in items])
+        sort = request.args.get('sort', 'id')
+        if sort not in self.sorts:
+            abort(error(400, 'sort must be one of: ' + ', '.join(sorted(self.sorts))))
+        per_page = request.args.get('per_page', app.config['CATALOG_PER_PAGE'], type=int)
+        per_page = max(1, min(per_page, app.config['CATALOG_MAX_PER_PAGE']))
+        try:
+            page = keyset_paginate(query, self.sorts[sort], self.model.id, request.args.get('after'), per_page)
+        except InvalidCursor:
+            abort(error(400, 'malformed cursor'))
+        return jsonify(items=self.serialize(page.items, names), next=page.next_cursor)
+
+    def item(self, id, query=None):
+        names = self.fieldset()
+        if query is None:
+            query = self.query(names)
+        row = query.filter(self.model.id == id).first()
+        if row is None:
+            abort(error(404, 'not found'))
+        return jsonify(self.serialize([row], names)[0])
+
+
+def strip(item, names):
+    if 'id' not in names:
+        item.pop('id', None)
+    return item
+
+
+books = Resource(Book, {
+    'id': field(Book.id),
+    'title': field(Book.book),
+    'type': field(Book.type),
+    'description': field(Book.description),
+    'price': field(Book.price),
+    'stock': field(Book.stock),
+    'thumbnail': cover('thumb'),
+    'image': cover(None),
+}, ['id', 'title', 'type', 'description', 'price', 'authors', 'thumbnail'],
+    links={'authors': (Association.books, Association.authors)},
+    sorts={'id': Book.id, 'title': Book.book, 'price': Book.price})
+
+authors = Resource(Author, {
+    'id': field(Author.id),
+    'name': field(Author.name),
+}, ['id', 'name', 'books'],
+    links={'books': (Association.authors, Association.books)},
+    sorts={'id': Author.id, 'name': Author.name})
+
+orders = Resource(Order, {
+    'id': field(Order.id),
+    'user_id': field(Order.user_id),
+    'book_id': field(Order.book_id),
+    'price': field(Order.price),
+    'quantity': field(Order.quantity),
+    'status': field(Order.status, lambda status: status.name),
+    'created_at': field(Order.created_at, lambda value: value and value.isoformat()),
+}, ['id', 'book_id', 'price', 'quantity', 'status', 'created_at'])
+
+
+def with_stock():
+    # Stock changes don't bump the catalog version (see stock.forget).
+    return 'stock' in books.fieldset()
+
+
+@app.route(API + '/books')
+@conditional(unless=with_stock)
+def api_books():
+    return books.collection()
+
+
+@app.route(API + '/books/<int:id>')
+@conditional(unless=with_stock)
+def api_book(id):
+    return books.item(id)
+
+
+@app.route(API + '/authors')
+@conditional()
+def api_authors():
+    return authors.collection()
+
+
+@app.route(API + '/authors/<int:id>')
+@conditional()
+def api_author(id):
+    return authors.item(id)
+
+
+@app.route(API + '/search')
+@conditional('search')
+def api_search():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['SEARCH_PER_PAGE']
+    hits, total = catalog_search.find(request.args.get('q', ''), page, per_page)
+    found = {}
+    for kind, resource in (('book', books), ('author', authors)):
+        ids = [hit.ref for hit in hits if hit.kind == kind]
+        if ids:
+            rows = resource.query(resource.default).filter(resource.model.id.in_(ids))
+            for item in resource.serialize(rows, resource.default):
+                found[kind, item['id']] = item
+    items = [dict(kind=hit.kind, score=hit.score, item=found[hit.kind, hit.ref])
+             for hit in hits if (hit.kind, hit.ref) in found]
+    return jsonify(items=items, total=total, page=page, per_page=per_page)
+
+
+def own_orders():
+    if not current_user.is_authenticated:
+        abort(error(401, 'login required'))
+    query = orders.query(orders.fieldset())
+    user_id = request.args.get('user', type=int)
+    if current_user.is_administrator():
+        return query.filter(Order.user_id == user_id) if user_id else query
+    return query.filter(Order.user_id == current_user.id)
+
+
+@app.route(API + '/orders')
+def api_orders():
+    query = own_orders()
+    status = request.args.get('status')
+    if status:
+        if status not in OrderStatus.__members__:
+            abort(error(400, 'status must be one of: ' + ', '.join(OrderStatus.__members__)))
+        query = query.filter(Order.status == OrderStatus[status])
+    return orders.collection(query)
+
+
+@app.route(API + '/orders/<int:id>')
+def api_order(id):
+    return orders.item(id, own_orders())
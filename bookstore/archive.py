@@ -0,0 +1,116 @@
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, Table, Column, Integer, DateTime, Enum, Index, select, exists, literal, and_, or_
+from bookstore import app, db
+from .cache import Record
+from .models import Book, Order, OrderStatus
+from .pagination import encode_cursor, decode_cursor, KeysetPage
+
+metadata = MetaData()
+
+
+def schema():
+    # With SQLite the archive is its own file, ATTACHed as `archive` by
+    # ensure() on the connections that read or write it; elsewhere it is a
+    # table next to `order`.
+    if app.config['ARCHIVE_DATABASE'] and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:///'):
+        return 'archive'
+    return None
+
+
+# Kept out of db.metadata: the archive is created here on first use, not by
+# create_all or the migration scripts.
+orders = Table('order_archive', metadata,
+               Column('id', Integer, primary_key=True, autoincrement=False),
+               Column('user_id', Integer, nullable=False),
+               Column('book_id', Integer),
+               Column('price', Integer, nullable=False),
+               Column('quantity', Integer, nullable=False),
+               Column('status', Enum(OrderStatus), nullable=False),
+               Column('created_at', DateTime),
+               Column('archived_at', DateTime, nullable=False),
+               Index('ix_order_archive_user_id', 'user_id', 'id'),
+               schema=schema())
+
+COLUMNS = ('id', 'user_id', 'book_id', 'price', 'quantity', 'status', 'created_at')
+
+_ready = False
+_ready_lock = threading.Lock()
+
+
+def ensure():
+    # Call before the session's first write: SQLite refuses to ATTACH inside
+    # a transaction. The attachment lasts as long as the pooled connection.
+    global _ready
+    conn = db.session.connection()
+    if schema() is not None and 'archive' not in conn.connection.info:
+        conn.execute('ATTACH DATABASE ? AS archive', (app.config['ARCHIVE_DATABASE'],))
+        conn.connection.info['archive'] = True
+    if not _ready:
+        with _ready_lock:
+            if not _ready:
+                metadata.create_all(conn, checkfirst=True)
+                _ready = True
+
+
+def archive(days=None, batch_size=None):
+    # Orders that reached the last status more than ARCHIVE_AFTER_DAYS ago
+    # move out of the hot table; rows from before status_changed_at existed
+    # fall back to created_at, and legacy rows with neither always qualify. Copy and delete commit separately, and the
+    # copy skips ids already archived, so an interrupted run only leaves
+    # duplicates that the next run clears; nothing is ever lost.
+    ensure()
+    cutoff = datetime.utcnow() - timedelta(days=days or app.config['ARCHIVE_AFTER_DAYS'])
+    batch_size = batch_size or app.config['ARCHIVE_BATCH_SIZE']
+    hot = Order.__table__
+    moved = 0
+    while True:
+        ids = [id for id, in db.session.query(Order.id)
+               .filter(Order.status == OrderStatus.in_work,
+                       or_(Order.status_changed_at < cutoff,
+                           and_(Order.status_changed_at == None,
+                                or_(Order.created_at < cutoff, Order.created_at == None))))
+               .order_by(Order.id).limit(batch_size)]
+        if not ids:
+            break
+        # Each commit may hand back a different pooled connection.
+        ensure()
+        source = (select([hot.c[name] for name in COLUMNS] + [literal(datetime.utcnow(), DateTime)])
+                  .where(hot.c.id.in_(ids))
+                  .where(~exists().where(orders.c.id == hot.c.id)))
+        db.session.execute(orders.insert().from_select(COLUMNS + ('archived_at',), source))
+        db.session.commit()
+        ensure()
+        copied = select([orders.c.id]).where(orders.c.id.in_(ids))
+        moved += db.session.execute(hot.delete().where(hot.c.id.in_(copied))).rowcount
+        db.session.commit()
+    return moved
+
+
+def history(user_id, cursor=None, per_page=20):
+    # Newest first across the hot table and the archive: one indexed query
+    # per side, merged by id.
+    ensure()
+    before = decode_cursor(cursor)
+    hot = (db.session.query(Order.id, Order.book_id, Order.price, Order.quantity, Order.status, Order.created_at)
+           .filter(Order.user_id == user_id, Order.status != OrderStatus.created))
+    cold = select([orders.c[name] for name in COLUMNS if name != 'user_id']).where(orders.c.user_id == user_id)
+    if before is not None:
+        hot = hot.filter(Order.id < before[0])
+        cold = cold.where(orders.c.id < before[0])
+    rows = {}
+    for archived, found in ((True, db.session.execute(cold.order_by(orders.c.id.desc()).limit(per_page + 1))),
+                            (False, hot.order_by(Order.id.desc()).limit(per_page + 1))):
+        for row in found:
+            rows[row.id] = Record(id=row.id, book_id=row.book_id, price=row.price, quantity=row.quantity,
+                                  status=row.status, created_at=row.created_at, archived=archived)
+    items = [rows[id] for id in sorted(rows, reverse=True)[:per_page + 1]]
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor([items[-1].id])
+    book_ids = set(item.book_id for item in items if item.book_id is not None)
+    titles = dict(db.session.query(Book.id, Book.book).filter(Book.id.in_(book_ids))) if book_ids else {}
+    for item in items:
+        item['title'] = titles.get(item.book_id)
+    return KeysetPage(items, next_cursor, per_page)
@@ -0,0 +1,130 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from flask_sqlalchemy import models_committed
+from bookstore import app, db
+from .models import Book, Author
+
+
+def normalize(label):
+    return ' '.join(label.casefold().split())
+
+
+class PrefixIndex():
+    # Sorted list of (key, kind, id, label) tuples: a lookup is one bisect plus
+    # a short forward scan, and the only per-entry overhead is the tuple.
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = []
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.built_at = None
+
+    def load(self, rows):
+        entries = []
+        keys = {}
+        for kind, id, label in rows:
+            if not label or len(entries) >= self.max_entries:
+                continue
+            key = normalize(label)
+            entries.append((key, kind, id, label))
+            keys[kind, id] = key
+        entries.sort()
+        with self.lock:
+            self.entries = entries
+            self.keys = keys
+            self.built_at = time.time()
+
+    def remove(self, kind, id):
+        with self.lock:
+            key = self.keys.pop((kind, id), None)
+            if key is None:
+                return
+            position = bisect_left(self.entries, (key, kind, id))
+            if position < len(self.entries) and self.entries[position][:3] == (key, kind, id):
+                del self.entries[position]
+
+    def add(self, kind, id, label):
+        self.remove(kind, id)
+        if not label:
+            return
+        key = normalize(label)
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                return
+            insort(self.entries, (key, kind, id, label))
+            self.keys[kind, id] = key
+
+    def lookup(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        entries = self.entries
+        position = bisect_left(entries, (prefix,))
+        found = []
+        while position < len(entries) and len(found) < limit:
+            key, kind, id, label = entries[position]
+            if not key.startswith(prefix):
+                break
+            found.append((kind, id, label))
+            position += 1
+        return found
+
+
+index = PrefixIndex(app.config['AUTOCOMPLETE_MAX_ENTRIES'])
+_building = threading.Lock()
+
+
+def catalog_rows():
+    for id, title in db.session.query(Book.id, Book.book).yield_per(10000):
+        yield 'book', id, title
+    for id, name in db.session.query(Author.id, Author.name).yield_per(10000):
+        yield 'author', id, name
+
+
+def build():
+    index.load(catalog_rows())
+
+
+def refresh_in_background():
+    if not _building.acquire(False):
+        return
+
+    def run():
+        try:
+            with app.app_context():
+                build()
+                db.session.remove()
+        finally:
+            _building.release()
+    threading.Thread(target=run, daemon=True).start()
+
+
+def suggest(prefix, limit=10):
+    if index.built_at is None:
+        with _building:
+            if index.built_at is None:
+                build()
+    elif time.time() - index.built_at > app.config['AUTOCOMPLETE_MAX_AGE']:
+        # Other workers' writes only reach us through a periodic rebuild;
+        # serve the current entries meanwhile.
+        refresh_in_background()
+    return index.lookup(prefix, limit)
+
+
+@models_committed.connect_via(app)
+def update_prefixes(sender, changes):
+    if index.built_at is None:
+        return
+    for model, operation in changes:
+        if isinstance(model, Book):
+            kind, label = 'book', model.book
+        elif isinstance(model, Author):
+            kind, label = 'author', model.name
+        else:
+            continue
+        if operation == 'delete':
+            index.remove(kind, model.id)
+        else:
+            index.add(kind, model.id, label)
@@ -0,0 +1,189 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from bookstore import app, db
+
+
+class Record(dict):
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+# Backend interface. Values must be picklable for out-of-process backends;
+# counters are never evicted, they version whole namespaces.
+class Cache():
+    shared = False
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(Cache):
+    # Counters live in this process only; other workers never see a bump.
+    shared = False
+
+    def __init__(self, max_entries=10000, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache(Cache):
+    shared = True
+
+    def __init__(self, client, default_ttl=300, prefix='bookstore:'):
+        self.client = client
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if ttl:
+            self.client.setex(self.prefix + key, ttl, data)
+        else:
+            self.client.set(self.prefix + key, data)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def make_cache(config, prefix='CACHE'):
+    option = lambda name: config['%s_%s' % (prefix, name)]
+    if option('BACKEND') == 'redis':
+        import redis
+        client = redis.StrictRedis.from_url(option('REDIS_URL'))
+        return RedisCache(client, option('DEFAULT_TTL'))
+    return LRUCache(option('MAX_ENTRIES'), option('DEFAULT_TTL'))
+
+
+cache = make_cache(app.config)
+
+
+def version(namespace='catalog'):
+    return cache.counter(namespace + ':version')
+
+
+def modified(namespace='catalog'):
+    return cache.get(namespace + ':modified')
+
+
+def versioned(key, namespace):
+    if isinstance(key, tuple):
+        key = ':'.join(str(part) for part in key)
+    return '%s:%d:%s' % (namespace, version(namespace), key)
+
+
+def remember(key, func, namespace='catalog', ttl=None):
+    key = versioned(key, namespace)
+    value = cache.get(key)
+    if value is None:
+        value = func()
+        cache.set(key, value, ttl)
+    return value
+
+
+def bump(namespace):
+    cache.incr(namespace + ':version')
+    cache.set(namespace + ':modified', time.time(), 0)
+
+
+def invalidate_later(namespace):
+    db.session.info.setdefault('cache_namespaces', set()).add(namespace)
+
+
+def forget_later(key, namespace='catalog'):
+    # Drops one remembered value after commit, for writes too frequent to
+    # version the whole namespace (stock counts).
+    db.session.info.setdefault('cache_keys', set()).add((namespace, key))
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    # Bumping only after commit keeps a concurrent reader from repopulating
+    # the new version with rows that are not yet visible.
+    for namespace in session.info.pop('cache_namespaces', ()):
+        bump(namespace)
+    for namespace, key in session.info.pop('cache_keys', ()):
+        cache.delete(versioned(key, namespace))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back(session):
+    session.info.pop('cache_namespaces', None)
+    session.info.pop('cache_keys', None)
@@ -0,0 +1,96 @@
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from flask import session
+from bookstore import app, db
+from .cache import make_cache
+from .models import Book, Order, OrderStatus
+from . import sales, stock
+
+Line = namedtuple('Line', 'book_id title price quantity total')
+
+store = make_cache(app.config, 'CART')
+
+
+class Cart():
+    # Items are {book_id: quantity} kept in the cart store under a random id
+    # from the signed session cookie; the database only sees the stock
+    # reservations until checkout.
+
+    def __init__(self, key, items):
+        self.key = key
+        self.items = items
+
+    @classmethod
+    def current(cls):
+        key = session.get('cart_id')
+        if key is None:
+            key = session['cart_id'] = uuid.uuid4().hex
+        return cls(key, dict(store.get('cart:' + key) or {}))
+
+    def __len__(self):
+        return sum(self.items.values())
+
+    def set(self, book_id, quantity):
+        book_id = int(book_id)
+        quantity = max(0, min(int(quantity), app.config['CART_MAX_QUANTITY']))
+        change = quantity - self.items.get(book_id, 0)
+        if change > 0 and not stock.reserve(self.key, book_id, change):
+            return False
+        if change < 0:
+            stock.unreserve(self.key, book_id, -change)
+        if quantity > 0:
+            self.items[book_id] = quantity
+        else:
+            self.items.pop(book_id, None)
+        self.save()
+        return True
+
+    def add(self, book_id, quantity=1):
+        return self.set(book_id, self.items.get(int(book_id), 0) + quantity)
+
+    def save(self):
+        if self.items:
+            store.set('cart:' + self.key, self.items)
+        else:
+            store.delete('cart:' + self.key)
+
+    def clear(self):
+        self.items = {}
+        self.save()
+
+    def prices(self):
+        if not self.items:
+            return {}
+        rows = db.session.query(Book.id, Book.book, Book.price).filter(Book.id.in_(list(self.items)))
+        return dict((id, (title, price or 0)) for id, title, price in rows)
+
+    def lines(self):
+        prices = self.prices()
+        return [Line(id, prices[id][0], prices[id][1], quantity, prices[id][1] * quantity)
+                for id, quantity in sorted(self.items.items()) if id in prices]
+
+    def checkout(self, user_id):
+        # One INSERT batch and one commit for the whole cart, sales totals
+        # included; prices are snapshotted from the catalog at this moment.
+        now = datetime.utcnow()
+        lines = self.lines()
+        try:
+            stock.claim(self.key, dict((line.book_id, line.quantity) for line in lines))
+        except stock.OutOfStock:
+            db.session.rollback()
+            raise
+        rows = [dict(user_id=user_id, book_id=line.book_id, price=line.price, quantity=line.quantity,
+                     status=OrderStatus.processing, created_at=now, status_changed_at=now)
+                for line in lines]
+        if rows:
+            db.session.bulk_insert_mappings(Order, rows)
+        created = (Order.user_id == user_id, Order.status == OrderStatus.created)
+        placed = [(row['book_id'], row['price'], row['quantity'], now) for row in rows]
+        placed.extend((book_id, price, quantity, now) for book_id, price, quantity in
+                      db.session.query(Order.book_id, Order.price, Order.quantity).filter(*created))
+        Order.transition(OrderStatus.processing, *created, commit=False)
+        sales.record(placed)
+        db.session.commit()
+        self.clear()
+        return len(rows)
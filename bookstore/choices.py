@@ -0,0 +1,87 @@
+from flask import url_for
+from markupsafe import Markup, escape
+from wtforms import SelectField
+from wtforms.widgets import Select
+from bookstore import app, db
+from .cache import remember
+from .models import Book, Author
+
+
+class ChoiceProvider():
+    # (id, label) pairs for admin dropdowns, cached in the catalog namespace
+    # so any catalog write rebuilds them once on next use.
+
+    def __init__(self, name, model, label):
+        self.name = name
+        self.model = model
+        self.label = label
+
+    def choices(self):
+        def load():
+            return [tuple(row) for row in
+                    db.session.query(self.model.id, self.label).order_by(self.label)]
+        return remember(('choices', self.name), load)
+
+    def count(self):
+        return remember(('choices-count', self.name),
+                        lambda: db.session.query(db.func.count(self.model.id)).scalar())
+
+    def inline(self):
+        return self.count() <= app.config['CHOICES_INLINE_LIMIT']
+
+    def label_for(self, id):
+        return db.session.query(self.label).filter(self.model.id == id).scalar()
+
+    def search(self, prefix, limit=20):
+        query = db.session.query(self.model.id, self.label)
+        if prefix:
+            query = query.filter(self.label.like(prefix.replace('%', '') + '%'))
+        return [tuple(row) for row in query.order_by(self.label).limit(limit)]
+
+
+providers = {
+    'books': ChoiceProvider('books', Book, Book.book),
+    'authors': ChoiceProvider('authors', Author, Author.name),
+}
+
+
+class SearchableSelect(Select):
+
+    def __call__(self, field, **kwargs):
+        html = super(SearchableSelect, self).__call__(field, **kwargs)
+        if field.provider.inline():
+            return html
+        search = ('<input type="search" class="form-control" placeholder="Поиск..." '
+                  'data-choices-for="%s" data-choices-url="%s">'
+                  % (escape(field.id), escape(url_for('lk_choices', name=field.provider.name))))
+        return Markup(search) + html
+
+
+class ChoiceSelectField(SelectField):
+    # Choices are fetched only when the field is rendered; above
+    # CHOICES_INLINE_LIMIT only the selected option is rendered and the rest
+    # come from /lk/choices as the admin types.
+    widget = SearchableSelect()
+
+    def __init__(self, label=None, validators=None, provider=None, **kwargs):
+        self.provider = providers[provider]
+        super(ChoiceSelectField, self).__init__(label, validators, coerce=int, **kwargs)
+
+    @property
+    def choices(self):
+        if self._choices is None:
+            if self.provider.inline():
+                self._choices = self.provider.choices()
+            elif self.data is not None:
+                self._choices = [(self.data, self.provider.label_for(self.data))]
+            else:
+                self._choices = []
+        return self._choices
+
+    @choices.setter
+    def choices(self, value):
+        self._choices = value
+
+    def pre_validate(self, form):
+        if self.data is None or self.provider.label_for(self.data) is None:
+            raise ValueError(self.gettext('Not a valid choice'))
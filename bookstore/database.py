@@ -0,0 +1,40 @@
+import sqlite3
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    # Adds the SQLite tuning profile: pragmas on every new connection and a
+    # real connection pool instead of the NullPool pysqlite gets by default,
+    # so page cache and mmap survive between requests.
+
+    def __init__(self, *args, **kwargs):
+        self.sqlite_pragmas = {}
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+        event.listen(Engine, 'connect', self.apply_pragmas)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername != 'sqlite' or info.database in (None, '', ':memory:'):
+            return
+        self.sqlite_pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+        pool_size = app.config.get('SQLITE_POOL_SIZE')
+        if pool_size:
+            options['poolclass'] = QueuePool
+            options['pool_size'] = pool_size
+            options['max_overflow'] = app.config.get('SQLITE_MAX_OVERFLOW', 0)
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['check_same_thread'] = False
+            busy_timeout = self.sqlite_pragmas.get('busy_timeout')
+            if busy_timeout:
+                connect_args['timeout'] = busy_timeout / 1000.0
+
+    def apply_pragmas(self, dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in self.sqlite_pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
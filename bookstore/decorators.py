@@ -7,7 +7,7 @@ from bookstore import models
 def admin_required(func):
     @wraps(func)
     def decorated_function(*args, **kwargs):
-        if current_user.role_id is not 1:
+        if not current_user.is_administrator():
             abort(403)
         return func(*args, **kwargs)
     return decorated_function
@@ -3,11 +3,11 @@ from flask import request
 from flask_wtf import FlaskForm
 from wtforms import TextField, PasswordField, StringField, SubmitField, BooleanField, FileField, IntegerField
 from wtforms.fields.html5 import TelField
-from wtforms.validators import Email, Required, Length, Regexp, EqualTo, NumberRange
+from wtforms.validators import Email, Required, Length, Regexp, EqualTo, NumberRange, Optional
 from wtforms import ValidationError
-from wtforms.ext.sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
-from .models import User, Book, Author, Association
+from .models import User, Author, Association
 from bookstore import db
+from .choices import ChoiceSelectField
 
 
 class LoginForm(FlaskForm):
@@ -46,7 +46,8 @@ class CreateBookForm(FlaskForm):
     type = StringField('Введите жанр книги', validators=[Required(), Length(1, 64)])
     description = TextField('Введите описание книги', validators=[Required()])
     price = IntegerField('Укажите цену книги', validators=[Required(), NumberRange(min=0, max=1000000)])
-    authors = QuerySelectField('Автор', query_factory=lambda: Author.query.all(), get_label='name')
+    stock = IntegerField('Количество на складе (пусто - без ограничений)', validators=[Optional(), NumberRange(min=0)])
+    authors = ChoiceSelectField('Автор', provider='authors')
     image = FileField('Обложка', validators=[Required()])
     submit_book = SubmitField('Добавить')
 
@@ -61,39 +62,34 @@ class CreateAuthorForm(FlaskForm):
 
 
 class DeleteBookForm(FlaskForm):
-    name = QuerySelectField('Книга', query_factory=lambda: Book.query.all(),
-    get_label='book')
+    name = ChoiceSelectField('Книга', provider='books')
     submit_book = SubmitField('Удалить')
 
 
 class DeleteAuthorForm(FlaskForm):
-    name = QuerySelectField('Автор', query_factory=lambda: Author.query.all(),
-    get_label='name')
+    name = ChoiceSelectField('Автор', provider='authors')
     submit_author = SubmitField('Удалить')
 
 
 class UpdateBookForm(FlaskForm):
-    choose_book = QuerySelectField('Выберите книгу',query_factory=lambda: Book.query.all(),
-    get_label='book')
+    choose_book = ChoiceSelectField('Выберите книгу', provider='books')
     name = StringField('Изменить название книги', validators=[Required(),    Length(1, 64)])
     type = StringField('Изменить жанр книги', validators=[Required(), Length(1, 64)])
     description = TextField('Изменить описание книги', validators=[Required()])
     price = IntegerField('Изменить цену книги', validators=[Required(), NumberRange(min=0, max=1000000)])
+    stock = IntegerField('Количество на складе (пусто - без ограничений)', validators=[Optional(), NumberRange(min=0)])
     submit_book = SubmitField('Обновить')
 
 
 class UpdateAuthorForm(FlaskForm):
-    name = QuerySelectField('Автор', query_factory=lambda: Author.query.all(),
-    get_label='name')
+    name = ChoiceSelectField('Автор', provider='authors')
     author = StringField('Изменить автора', validators=[Required(), Length(1, 64)])
     submit_author = SubmitField('Обновить')
 
 
 class AddAuthorForm(FlaskForm):
-    book = QuerySelectField('Книга', query_factory=lambda: Book.query.all(),
-    get_label='book')
-    author = QuerySelectField('Автор',query_factory=lambda: Author.query.all(),
-    get_label='name')
+    book = ChoiceSelectField('Книга', provider='books')
+    author = ChoiceSelectField('Автор', provider='authors')
     submit_add = SubmitField('Добавить')
 
     def validate_author(self, form):
@@ -102,6 +98,10 @@ class AddAuthorForm(FlaskForm):
 
 
 class UploadUpdate(FlaskForm):
-    book_name = QuerySelectField('Книга', query_factory=lambda: Book.query.all(), get_label='book')
+    book_name = ChoiceSelectField('Книга', provider='books')
     new_image = FileField('Добавьте файл', validators=[Required()])
     submit_image = SubmitField('Обновить')
+
+
+class WorkOrdersForm(FlaskForm):
+    submit_work = SubmitField('Выбранные в работу')
@@ -0,0 +1,183 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+from datetime import datetime
+from functools import wraps
+from flask import request, session, send_file, safe_join
+from flask_login import current_user
+from werkzeug.exceptions import NotFound
+from bookstore import app
+from .cache import cache, version, modified
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+# Preference order; also the suffixes of precompressed static files
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE)
+
+
+def accepted_encoding():
+    offered = [name for name, _ in ENCODINGS if name != 'br' or brotli is not None]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, app.config['COMPRESS_LEVEL'])
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_templates_digest = None
+
+
+def templates_digest():
+    # Part of every page ETag, so a deploy with changed templates never
+    # revalidates a page rendered by the old ones.
+    global _templates_digest
+    if _templates_digest is None:
+        digest = hashlib.sha256()
+        folder = os.path.join(app.root_path, app.template_folder)
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode('utf-8'))
+                digest.update(file_digest(path).encode('ascii'))
+        _templates_digest = digest.hexdigest()
+    return _templates_digest
+
+
+def page_etag(namespace):
+    user = current_user.get_id() if current_user.is_authenticated else ''
+    key = '%s:%s:%s:%s' % (templates_digest(), version(namespace), user, request.full_path)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def http_cache_enabled():
+    # ETags come from the cache version counters, which only mean the same
+    # thing in every worker when the cache backend is shared.
+    enabled = app.config['HTTP_CACHE_ENABLED']
+    return cache.shared if enabled is None else enabled
+
+
+def conditional(namespace='catalog', unless=None):
+    # For pages rendered only from `namespace` data: revalidations are
+    # answered from the version counter without running the view. `unless`
+    # names requests that include data the counter does not cover.
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if (not http_cache_enabled() or request.method != 'GET' or '_flashes' in session
+                    or (unless is not None and unless())):
+                return func(*args, **kwargs)
+            etag = page_etag(namespace)
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            last_modified = modified(namespace)
+            if last_modified is not None:
+                response.last_modified = datetime.utcfromtimestamp(int(last_modified))
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+_static_digests = {}
+
+
+def static_digest(filename):
+    path = safe_join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _static_digests.get(filename)
+    if cached is None or cached[0] != mtime:
+        cached = _static_digests[filename] = (mtime, file_digest(path)[:12])
+    return cached[1]
+
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        digest = static_digest(values['filename'])
+        if digest is not None:
+            values['v'] = digest
+
+
+def static_file(filename):
+    # Serves the .br/.gz sibling built by assets.py when the client accepts
+    # it; URLs carrying the current fingerprint are cached for a year.
+    path = safe_join(app.static_folder, filename)
+    if not os.path.isfile(path):
+        raise NotFound()
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    served, encoding = path, None
+    if compressible(mimetype):
+        for name, suffix in ENCODINGS:
+            variant = path + suffix
+            if (request.accept_encodings[name] and os.path.isfile(variant)
+                    and os.path.getmtime(variant) >= os.path.getmtime(path)):
+                served, encoding = variant, name
+                break
+    response = send_file(served, mimetype=mimetype, conditional=True)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if compressible(mimetype):
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    fingerprint = request.args.get('v')
+    if fingerprint and fingerprint == static_digest(filename):
+        response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+        response.expires = int(time.time() + app.config['STATIC_MAX_AGE'])
+    else:
+        response.cache_control.max_age = 0
+        response.cache_control.must_revalidate = True
+        response.expires = None
+    return response
+
+
+app.view_functions['static'] = static_file
+
+
+@app.after_request
+def compress_response(response):
+    if (not app.config['COMPRESS_ENABLED'] or response.direct_passthrough or response.is_streamed
+            or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or not compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag('%s-%s' % (etag, encoding))
+    return response
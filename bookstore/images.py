@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+import tempfile
+from flask import request, abort
+from werkzeug.wsgi import wrap_file
+from bookstore import app
+from .models import Book
+from .tasks import task, enqueue_after_commit
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+
+
+def sniff_mimetype(data):
+    for signature, mimetype in SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def store_path(digest):
+    return os.path.join(app.config['IMAGE_STORE'], digest[:2], digest[2:])
+
+
+def put(data):
+    digest = hashlib.sha256(data).hexdigest()
+    path = store_path(digest)
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return digest
+
+
+def make_thumbnail(data):
+    if Image is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        format = image.format
+        image.thumbnail(app.config['THUMBNAIL_SIZE'])
+        out = io.BytesIO()
+        image.save(out, format=format)
+    except (IOError, ValueError):
+        return None
+    return out.getvalue()
+
+
+def cover_fields(data):
+    # Blobs live in the content-addressed store; the row keeps only hashes.
+    # The thumbnail starts out as the full cover and is swapped in by the
+    # images.thumbnail job once the row is committed.
+    image_hash = put(data)
+    if Image is not None:
+        enqueue_after_commit('images.thumbnail', image_hash=image_hash)
+    return dict(image=None,
+                image_hash=image_hash,
+                thumb_hash=image_hash,
+                image_type=sniff_mimetype(data))
+
+
+@task('images.thumbnail')
+def build_thumbnail(image_hash):
+    # Books share a cover by hash, so an import queues this job once per
+    # row; only the first run for a hash has anything left to do.
+    pending = (Book.image_hash == image_hash, Book.thumb_hash == image_hash)
+    if Book.query.filter(*pending).first() is None:
+        return
+    with open(store_path(image_hash), 'rb') as f:
+        thumbnail = make_thumbnail(f.read())
+    if thumbnail:
+        Book.bulk_update(pending, thumb_hash=put(thumbnail))
+
+
+def cache_headers(response, digest, versioned):
+    response.set_etag(digest)
+    response.cache_control.public = True
+    if versioned:
+        response.cache_control.max_age = app.config['IMAGE_MAX_AGE']
+    else:
+        response.cache_control.max_age = 0
+        response.cache_control.must_revalidate = True
+    return response
+
+
+def send_cover(digest, mimetype, versioned):
+    path = store_path(digest)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        abort(404)
+    if app.use_x_sendfile:
+        response = app.response_class(mimetype=mimetype, headers={'X-Sendfile': path})
+    else:
+        response = app.response_class(wrap_file(request.environ, open(path, 'rb')),
+                                      mimetype=mimetype, direct_passthrough=True)
+    response.content_length = size
+    cache_headers(response, digest, versioned)
+    return response.make_conditional(request, accept_ranges=not app.use_x_sendfile,
+                                     complete_length=size)
+
+
+def send_blob(data, versioned):
+    digest = hashlib.sha256(data).hexdigest()
+    response = app.response_class(data, mimetype=sniff_mimetype(data))
+    cache_headers(response, digest, versioned)
+    return response.make_conditional(request)
@@ -0,0 +1,157 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, abort, has_request_context
+from flask_login import current_user
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from bookstore import app
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram():
+
+    def __init__(self, name, help, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        with self.lock:
+            items = sorted((key, (list(counts), total, count))
+                           for key, (counts, total, count) in self.series.items())
+        for label_value, (counts, total, count) in items:
+            label = '%s="%s"' % (self.label, escape_label(label_value))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, bound, cumulative))
+            lines.append('%s_sum{%s} %r' % (self.name, label, total))
+            lines.append('%s_count{%s} %d' % (self.name, label, count))
+        return '\n'.join(lines)
+
+
+request_seconds = Histogram('bookstore_request_seconds', 'Request latency by endpoint.', 'endpoint')
+sql_queries = Histogram('bookstore_request_sql_queries', 'SQL statements per request.', 'endpoint',
+                        COUNT_BUCKETS)
+sql_seconds = Histogram('bookstore_request_sql_seconds', 'SQL time per request.', 'endpoint')
+template_seconds = Histogram('bookstore_template_render_seconds', 'Template render time.', 'template')
+search_seconds = Histogram('bookstore_search_seconds', 'Search backend query time.', 'backend')
+
+registry = [request_seconds, sql_queries, sql_seconds, template_seconds, search_seconds]
+
+# Set by create_app(): package import to app ready
+startup_seconds = None
+
+
+def enabled():
+    return app.config['METRICS_ENABLED']
+
+
+class TimedTemplate(Template):
+
+    def render(self, *args, **kwargs):
+        if not enabled():
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        start = time.time()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            template_seconds.observe(self.name, time.time() - start)
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    if enabled():
+        conn.info.setdefault('query_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.time() - starts.pop()
+    if has_request_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+
+
+@app.before_request
+def start_request():
+    if enabled():
+        g.request_start = time.time()
+    if (app.config['PROFILING_ENABLED'] and 'profile' in request.args
+            and current_user.is_authenticated and current_user.is_administrator()):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def end_request(response):
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.disable()
+        response = profile_response(profiler, response)
+    start = g.get('request_start')
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        request_seconds.observe(endpoint, time.time() - start)
+        sql_queries.observe(endpoint, g.get('sql_queries', 0))
+        sql_seconds.observe(endpoint, g.get('sql_seconds', 0.0))
+    return response
+
+
+def profile_response(profiler, response):
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '%s-%d.prof' % (request.endpoint, time.time() * 1000))
+    profiler.dump_stats(path)
+    if request.args.get('profile') != 'text':
+        response.headers['X-Profile'] = path
+        return response
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(50)
+    return app.response_class(out.getvalue(), mimetype='text/plain')
+
+
+@app.route('/metrics')
+def metrics():
+    if not enabled():
+        abort(404)
+    body = '\n'.join(histogram.render() for histogram in registry) + '\n'
+    if startup_seconds is not None:
+        body += ('# HELP bookstore_startup_seconds Package import to app ready.\n'
+                 '# TYPE bookstore_startup_seconds gauge\n'
+                 'bookstore_startup_seconds %r\n' % startup_seconds)
+    return app.response_class(body, mimetype='text/plain; version=0.0.4')
@@ -1,9 +1,12 @@
-from bookstore import db, views, login_manager
-from sqlalchemy.orm import relationship, backref
+import enum
+from datetime import datetime
+from bookstore import db, login_manager
+from sqlalchemy import inspect
+from sqlalchemy.orm import relationship, backref, selectinload, joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-import flask.ext.whooshalchemy as whooshalchemy
 from bookstore import app
+from .cache import Record, remember, invalidate_later
 
 admin_email = 'admin@admin.ru'
 
@@ -11,56 +14,112 @@ admin_permission = 1
 
 user_permission = 2
 
+def eager(attribute):
+    # Relationships stay lazy by default: eager on both sides would walk the
+    # whole book/author graph. Views opt in per query with this option.
+    if app.config['RELATIONSHIP_LOADING'] == 'joined':
+        return joinedload(attribute)
+    return selectinload(attribute)
+
+class Identity(UserMixin):
+    # What current_user needs on every request, rebuilt from the users cache
+    # instead of a User row; views that need the row load it by id.
+
+    def __init__(self, record):
+        self.__dict__.update(record)
+
+    def is_administrator(self):
+        return self.role_id == admin_permission
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    record = User.get_cached(int(user_id), ttl=app.config['USER_CACHE_TTL'])
+    return record and Identity(record)
 
 class CRUDMixin():
+    __cache_namespace__ = None
 
     @classmethod
     def create(cls, **kwargs):
         instance = cls(**kwargs)
         return instance.save()
 
+    @classmethod
+    def get_cached(cls, id, ttl=None):
+        def load():
+            instance = cls.query.get(id)
+            return instance and instance.to_record()
+        if cls.__cache_namespace__ is None:
+            return load()
+        return remember((cls.__name__, id), load, cls.__cache_namespace__, ttl)
+
+    def to_record(self):
+        columns = inspect(self).mapper.column_attrs
+        return Record((attr.key, getattr(self, attr.key)) for attr in columns if not attr.deferred)
+
+    def invalidate(self):
+        if self.__cache_namespace__ is not None:
+            invalidate_later(self.__cache_namespace__)
+
+    @classmethod
+    def bulk_update(cls, criteria, commit=True, **values):
+        # One UPDATE ... WHERE for the whole set instead of a commit per row.
+        count = cls.query.filter(*criteria).update(values, synchronize_session=False)
+        if cls.__cache_namespace__ is not None:
+            invalidate_later(cls.__cache_namespace__)
+        if commit:
+            db.session.commit()
+        return count
+
     def update(self, commit=True, **kwargs):
         for attr, value in kwargs.items():
             setattr(self, attr, value)
         return commit and self.save() or self
 
     def save(self, commit=True):
+        self.invalidate()
         db.session.add(self)
         if commit:
             db.session.commit()
         return self
 
     def delete(self, commit=True):
+        self.invalidate()
         db.session.delete(self)
         return commit and db.session.commit()
 
 
 class Association(db.Model, CRUDMixin):
+    __cache_namespace__ = 'catalog'
+
     books = db.Column(db.String(30), db.ForeignKey('book.id', ondelete='cascade'),
     primary_key=True)
     authors = db.Column(db.String(30), db.ForeignKey('author.id', ondelete='cascade'), primary_key=True)
 
 class Book(db.Model, CRUDMixin):
-    __searchable__ = ['book']
+    __cache_namespace__ = 'catalog'
 
     id = db.Column(db.Integer, primary_key=True)
-    book = db.Column(db.String(30))
+    book = db.Column(db.String(30), index=True)
     type = db.Column(db.String(30))
     description = db.Column(db.String(180))
-    price = db.Column(db.String(30))
-    image = db.Column(db.LargeBinary)
+    # Minor units (kopecks)
+    price = db.Column(db.Integer, index=True)
+    image = db.deferred(db.Column(db.LargeBinary))
+    # Indexed for the images.thumbnail job, which updates by cover hash
+    image_hash = db.Column(db.String(64), index=True)
+    thumb_hash = db.Column(db.String(64))
+    image_type = db.Column(db.String(30))
+    # Units on hand, not counting live reservations; NULL means untracked
+    stock = db.Column(db.Integer)
     authors = db.relationship('Author', secondary='association', back_populates='books')
 
     def __repr__(self):
         return '%r' % self.book
 
-whooshalchemy.whoosh_index(app, Book)
-
 class Author(db.Model, CRUDMixin):
-    __searchable__ = ['name']
+    __cache_namespace__ = 'catalog'
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), unique = True)
@@ -69,9 +128,40 @@ class Author(db.Model, CRUDMixin):
     def __repr__(self):
         return '%r' % self.name
 
-whooshalchemy.whoosh_index(app, Author)
+class Reservation(db.Model):
+    __table_args__ = (db.UniqueConstraint('cart_id', 'book_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.String(32), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('book.id', ondelete='cascade'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class BookSales(db.Model):
+    book_id = db.Column(db.Integer, db.ForeignKey('book.id', ondelete='cascade'), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AuthorSales(db.Model):
+    author_id = db.Column(db.Integer, db.ForeignKey('author.id', ondelete='cascade'), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
 
 class User(db.Model, UserMixin, CRUDMixin):
+    __cache_namespace__ = 'users'
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(30), unique = False, index = True)
     email = db.Column(db.String(100), unique = True)
@@ -103,11 +193,24 @@ class User(db.Model, UserMixin, CRUDMixin):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, app.config['PASSWORD_HASH_METHOD'],
+                                                    app.config['PASSWORD_SALT_LENGTH'])
 
     def verify_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def rehash_password(self, password):
+        # Call after a successful verify_password: hashes made with an older
+        # PASSWORD_HASH_METHOD are upgraded while the plain text is at hand.
+        if self.password_hash.split('$', 1)[0] != app.config['PASSWORD_HASH_METHOD']:
+            self.password = password
+            self.save()
+
+    def to_record(self):
+        record = super(User, self).to_record()
+        record.pop('password_hash', None)
+        return record
+
 
 class Role(db.Model, CRUDMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -118,14 +221,37 @@ class Role(db.Model, CRUDMixin):
         return '<Role %r>' % self.name
 
 
+class OrderStatus(enum.Enum):
+    created = 'создан'
+    processing = 'заказ в обработке'
+    in_work = 'В работе'
+
+    @property
+    def label(self):
+        return self.value
+
+
 class Order(db.Model, CRUDMixin):
+    __table_args__ = (db.Index('ix_order_user_status', 'user_id', 'status'),
+                      db.Index('ix_order_status_changed', 'status', 'status_changed_at'))
+
     id = db.Column(db.Integer, primary_key=True)
-    user = db.Column(db.String(30))
-    book = db.Column(db.String(128))
-    email = db.Column(db.String(30))
-    number = db.Column(db.String(30), unique=True)
-    price = db.Column(db.String(30))
-    status = db.Column(db.String(30))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('book.id', ondelete='set null'), index=True)
+    # Minor units (kopecks), snapshotted from Book.price at purchase
+    price = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    status = db.Column(db.Enum(OrderStatus), nullable=False, default=OrderStatus.created, index=True)
+    # NULL for orders migrated from the legacy table, which had no timestamp
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set by transition(); the archive ages orders from here
+    status_changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', backref=db.backref('orders', lazy='dynamic'))
+    book = db.relationship('Book')
+
+    @classmethod
+    def transition(cls, status, *criteria, **kwargs):
+        return cls.bulk_update(criteria, status=status, status_changed_at=datetime.utcnow(), **kwargs)
 
     def __repr__(self):
         return 'Заказ %r' % self.id
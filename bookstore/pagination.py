@@ -0,0 +1,89 @@
+import base64
+import binascii
+import json
+from numbers import Number
+from sqlalchemy import or_
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, length=1):
+    # [sort value, id] or [id]; the sort value may be null, every id is an
+    # integer. Anything else was not issued by us.
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    if not isinstance(values[-1], int) or isinstance(values[-1], bool):
+        raise InvalidCursor(cursor)
+    if length == 2 and not (values[0] is None or isinstance(values[0], string_types + (Number,))):
+        raise InvalidCursor(cursor)
+    return values
+
+
+class KeysetPage():
+
+    def __init__(self, items, next_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=20):
+    # Seek pagination: the cursor holds the sort key of the last row shown,
+    # so every page is an index range scan instead of OFFSET n. Pages keep a
+    # plain ORDER BY sort, id, which SQLite serves from the sort column's
+    # index with NULLs first; the NULL run is paged by id on its own and the
+    # page that leaves it continues into the non-NULL range.
+    by_id = sort_column is id_column
+    after = decode_cursor(cursor, 1 if by_id else 2)
+    if by_id:
+        if after is not None:
+            query = query.filter(id_column > after[-1])
+        rows = query.order_by(id_column).limit(per_page + 1).all()
+    elif after is None:
+        rows = query.order_by(sort_column, id_column).limit(per_page + 1).all()
+    elif after[0] is None:
+        rows = (query.filter(sort_column == None, id_column > after[1])
+                .order_by(sort_column, id_column).limit(per_page + 1).all())
+        if len(rows) <= per_page:
+            rows += (query.filter(sort_column != None)
+                     .order_by(sort_column, id_column).limit(per_page + 1 - len(rows)).all())
+    else:
+        value, last_id = after
+        rows = (query.filter(sort_column >= value, or_(sort_column > value, id_column > last_id))
+                .order_by(sort_column, id_column).limit(per_page + 1).all())
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        if by_id:
+            next_cursor = encode_cursor([getattr(last, id_column.key)])
+        else:
+            next_cursor = encode_cursor([getattr(last, sort_column.key),
+                                         getattr(last, id_column.key)])
+    return KeysetPage(items, next_cursor, per_page)
@@ -0,0 +1,39 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from bookstore import app
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    def decorator(func):
+        func.query_budget = limit
+        return func
+    return decorator
+
+
+def enabled():
+    return app.config.get('QUERY_BUDGET') is not None and (app.debug or app.testing)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and enabled():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+@app.after_request
+def check_query_budget(response):
+    if not enabled():
+        return response
+    count = g.get('query_count', 0)
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', app.config['QUERY_BUDGET'])
+    response.headers['X-Query-Count'] = str(count)
+    if count > budget:
+        raise QueryBudgetExceeded('%s issued %d queries, budget is %d'
+                                  % (request.endpoint, count, budget))
+    return response
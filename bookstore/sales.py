@@ -0,0 +1,118 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import bindparam, func
+from bookstore import db
+from . import archive
+from .models import Association, Author, Book, BookSales, AuthorSales, DailySales, Order, OrderStatus
+
+# Statuses that count as a sale; 'created' orders are still in the cart.
+PLACED = (OrderStatus.processing, OrderStatus.in_work)
+
+FIELDS = ('orders', 'quantity', 'revenue')
+
+
+def totals():
+    return defaultdict(lambda: [0, 0, 0])
+
+
+def add(target, delta):
+    for i, value in enumerate(delta):
+        target[i] += value
+
+
+def authors_of(book_ids):
+    links = (db.session.query(Association.books, Association.authors)
+             .filter(Association.books.in_([str(id) for id in book_ids])))
+    return [(int(book), int(author)) for book, author in links]
+
+
+def apply(model, key, deltas):
+    # At most three statements per table whatever the number of keys: find
+    # the rows that exist, one executemany UPDATE for them and one INSERT
+    # for the rest. Runs inside the caller's transaction so it commits with
+    # the orders.
+    if not deltas:
+        return
+    table = model.__table__
+    existing = set(value for value, in db.session.query(table.c[key]).filter(table.c[key].in_(list(deltas))))
+    updates = [dict(zip(('key',) + tuple('d_' + name for name in FIELDS), [value] + list(delta)))
+               for value, delta in deltas.items() if value in existing]
+    inserts = [dict(zip((key,) + FIELDS, [value] + list(delta)))
+               for value, delta in deltas.items() if value not in existing]
+    if updates:
+        db.session.execute(table.update().where(table.c[key] == bindparam('key')).values(
+            dict((name, table.c[name] + bindparam('d_' + name)) for name in FIELDS)), updates)
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def record(orders, sign=1):
+    # orders: (book_id, price, quantity, created_at) for orders entering
+    # (sign=1) or leaving (sign=-1) the placed statuses.
+    books, authors, days = totals(), totals(), totals()
+    for book_id, price, quantity, created_at in orders:
+        delta = (sign, sign * quantity, sign * price * quantity)
+        if created_at is not None:
+            add(days[created_at.date()], delta)
+        if book_id is not None:
+            add(books[book_id], delta)
+    if books:
+        for book_id, author_id in authors_of(books):
+            add(authors[author_id], books[book_id])
+    apply(BookSales, 'book_id', books)
+    apply(AuthorSales, 'author_id', authors)
+    apply(DailySales, 'day', days)
+
+
+def as_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def rebuild():
+    # Recompute everything from the order table and its archive, e.g. after
+    # a migration.
+    archive.ensure()
+    books, authors, days = totals(), totals(), totals()
+    for table in (Order.__table__, archive.orders):
+        placed = table.c.status.in_(PLACED)
+        amount = (func.count(table.c.id), func.sum(table.c.quantity), func.sum(table.c.price * table.c.quantity))
+        day = func.date(table.c.created_at)
+        for row in (db.session.query(table.c.book_id, *amount)
+                    .filter(placed, table.c.book_id != None).group_by(table.c.book_id)):
+            add(books[row[0]], row[1:])
+        for row in db.session.query(day, *amount).filter(placed, table.c.created_at != None).group_by(day):
+            add(days[as_date(row[0])], row[1:])
+    for book_id, author_id in authors_of(books):
+        add(authors[author_id], books[book_id])
+    for model in (BookSales, AuthorSales, DailySales):
+        model.query.delete(synchronize_session=False)
+    for model, key, rows in ((BookSales, 'book_id', books), (AuthorSales, 'author_id', authors),
+                             (DailySales, 'day', days)):
+        if rows:
+            db.session.execute(model.__table__.insert(),
+                               [dict(zip((key,) + FIELDS, [value] + list(v))) for value, v in rows.items()])
+    db.session.commit()
+
+
+def dashboard(limit=10, days=30):
+    total = db.session.query(func.coalesce(func.sum(DailySales.orders), 0),
+                             func.coalesce(func.sum(DailySales.quantity), 0),
+                             func.coalesce(func.sum(DailySales.revenue), 0)).one()
+    top_books = (db.session.query(Book.id, Book.book, BookSales.orders, BookSales.quantity, BookSales.revenue)
+                 .join(BookSales, BookSales.book_id == Book.id)
+                 .order_by(BookSales.revenue.desc()).limit(limit))
+    top_authors = (db.session.query(Author.id, Author.name, AuthorSales.orders, AuthorSales.quantity,
+                                    AuthorSales.revenue)
+                   .join(AuthorSales, AuthorSales.author_id == Author.id)
+                   .order_by(AuthorSales.revenue.desc()).limit(limit))
+    recent = (DailySales.query.filter(DailySales.day >= date.today() - timedelta(days=days))
+              .order_by(DailySales.day.desc()))
+    return dict(
+        total=dict(zip(FIELDS, total)),
+        books=[dict(zip(('id', 'title') + FIELDS, row)) for row in top_books],
+        authors=[dict(zip(('id', 'name') + FIELDS, row)) for row in top_authors],
+        days=[dict(day=row.day.isoformat(), orders=row.orders, quantity=row.quantity, revenue=row.revenue)
+              for row in recent],
+    )
@@ -0,0 +1,258 @@
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from flask_sqlalchemy import models_committed
+from sqlalchemy import text
+from bookstore import app, db
+from .models import Book, Author, Association, eager
+from . import metrics
+from .cache import bump
+from .tasks import task, enqueue
+
+
+Hit = namedtuple('Hit', 'kind ref score')
+
+Result = namedtuple('Result', 'kind score item')
+
+
+class SearchPage():
+
+    def __init__(self, items, total, page, per_page):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page * self.per_page < self.total
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def book_document(book):
+    return dict(key='book:%d' % book.id,
+                kind='book',
+                ref=book.id,
+                title=book.book or '',
+                authors=' '.join(author.name for author in book.authors),
+                description=book.description or '',
+                type=book.type or '')
+
+
+def author_document(author):
+    return dict(key='author:%d' % author.id,
+                kind='author',
+                ref=author.id,
+                title=author.name or '',
+                authors='',
+                description='',
+                type='')
+
+
+class WhooshBackend():
+
+    def __init__(self, path):
+        from whoosh import index
+        from whoosh.fields import Schema, ID, TEXT, STORED
+        from whoosh.qparser import MultifieldParser, OrGroup
+        schema = Schema(key=ID(unique=True, stored=True),
+                        kind=ID(stored=True),
+                        ref=STORED,
+                        title=TEXT(field_boost=4.0),
+                        authors=TEXT(field_boost=2.0),
+                        description=TEXT,
+                        type=TEXT)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if index.exists_in(path):
+            self.index = index.open_dir(path)
+        else:
+            self.index = index.create_in(path, schema)
+        self.parser = MultifieldParser(['title', 'authors', 'description', 'type'],
+                                       self.index.schema, group=OrGroup)
+        self.local = threading.local()
+
+    def searcher(self):
+        # One long-lived searcher per thread; refresh() is a cheap generation
+        # check that only reopens segments after a commit, and it closes the
+        # old reader itself when it does.
+        searcher = getattr(self.local, 'searcher', None)
+        if searcher is None:
+            searcher = self.index.searcher()
+        else:
+            searcher = searcher.refresh()
+        self.local.searcher = searcher
+        return searcher
+
+    def search(self, query, offset, limit):
+        results = self.searcher().search(self.parser.parse(query), limit=offset + limit)
+        hits = [Hit(hit['kind'], hit['ref'], hit.score) for hit in results[offset:offset + limit]]
+        return hits, len(results)
+
+    def update(self, documents, deleted=()):
+        from whoosh.writing import AsyncWriter
+        writer = AsyncWriter(self.index)
+        for key in deleted:
+            writer.delete_by_term('key', key)
+        for document in documents:
+            writer.update_document(**document)
+        writer.commit()
+
+    def clear(self):
+        from whoosh import index
+        self.index = index.create_in(self.index.storage.folder, self.index.schema)
+
+
+class Fts5Backend():
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.engine.execute('CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5('
+                            'key UNINDEXED, kind UNINDEXED, ref UNINDEXED, '
+                            'title, authors, description, type)')
+
+    def match(self, query):
+        terms = re.findall(r'\w+', query, re.UNICODE)
+        return ' OR '.join('"%s"' % term for term in terms)
+
+    def search(self, query, offset, limit):
+        match = self.match(query)
+        if not match:
+            return [], 0
+        with self.engine.connect() as conn:
+            total = conn.execute(text('SELECT count(*) FROM search_index '
+                                      'WHERE search_index MATCH :match'), match=match).scalar()
+            rows = conn.execute(text('SELECT kind, ref, bm25(search_index, 0, 0, 0, 4.0, 2.0, 1.0, 1.0) AS rank '
+                                     'FROM search_index WHERE search_index MATCH :match '
+                                     'ORDER BY rank LIMIT :limit OFFSET :offset'),
+                                match=match, limit=limit, offset=offset)
+            hits = [Hit(row.kind, int(row.ref), -row.rank) for row in rows]
+        return hits, total
+
+    def update(self, documents, deleted=()):
+        keys = list(deleted) + [document['key'] for document in documents]
+        with self.engine.begin() as conn:
+            for key in keys:
+                conn.execute(text('DELETE FROM search_index WHERE key = :key'), key=key)
+            if documents:
+                conn.execute(text('INSERT INTO search_index (key, kind, ref, title, authors, description, type) '
+                                  'VALUES (:key, :kind, :ref, :title, :authors, :description, :type)'),
+                             documents)
+
+    def clear(self):
+        self.engine.execute('DELETE FROM search_index')
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if app.config['SEARCH_BACKEND'] == 'fts5':
+                    _backend = Fts5Backend(db.engine)
+                else:
+                    _backend = WhooshBackend(os.path.join(app.config['WHOOSH_BASE'], 'catalog'))
+    return _backend
+
+
+def find(query, page=1, per_page=20):
+    if not query or not query.strip():
+        return [], 0
+    index = backend()
+    start = time.time()
+    hits, total = index.search(query, (page - 1) * per_page, per_page)
+    if metrics.enabled():
+        metrics.search_seconds.observe(index.__class__.__name__, time.time() - start)
+    return hits, total
+
+
+def search(query, page=1, per_page=20):
+    hits, total = find(query, page, per_page)
+    book_ids = [hit.ref for hit in hits if hit.kind == 'book']
+    author_ids = [hit.ref for hit in hits if hit.kind == 'author']
+    found = {}
+    if book_ids:
+        for book in Book.query.options(eager(Book.authors)).filter(Book.id.in_(book_ids)):
+            found['book', book.id] = book
+    if author_ids:
+        for author in Author.query.options(eager(Author.books)).filter(Author.id.in_(author_ids)):
+            found['author', author.id] = author
+    items = [Result(hit.kind, hit.score, found[hit.kind, hit.ref])
+             for hit in hits if (hit.kind, hit.ref) in found]
+    return SearchPage(items, total, page, per_page)
+
+
+@task('search.reindex')
+def reindex(book_ids=(), author_ids=(), deleted=()):
+    book_ids = set(book_ids)
+    if author_ids:
+        rows = db.session.query(Association.books).filter(Association.authors.in_(list(author_ids)))
+        book_ids.update(int(id) for id, in rows)
+    book_ids = sorted(id for id in book_ids if 'book:%d' % id not in deleted)
+    author_ids = list(author_ids)
+    documents = []
+    for start in range(0, len(book_ids), 500):
+        chunk = book_ids[start:start + 500]
+        books = Book.query.options(eager(Book.authors)).filter(Book.id.in_(chunk))
+        documents.extend(book_document(book) for book in books)
+    for start in range(0, len(author_ids), 500):
+        chunk = author_ids[start:start + 500]
+        documents.extend(author_document(author)
+                         for author in Author.query.filter(Author.id.in_(chunk)))
+    if documents or deleted:
+        backend().update(documents, list(deleted))
+        bump('search')
+
+
+def rebuild(batch_size=1000):
+    index = backend()
+    index.clear()
+    last_id = 0
+    while True:
+        books = (Book.query.options(eager(Book.authors)).filter(Book.id > last_id)
+                 .order_by(Book.id).limit(batch_size).all())
+        if not books:
+            break
+        index.update([book_document(book) for book in books])
+        last_id = books[-1].id
+        db.session.expunge_all()
+    authors = [author_document(author) for author in Author.query.order_by(Author.id)]
+    index.update(authors)
+    bump('search')
+
+
+@models_committed.connect_via(app)
+def index_changes(sender, changes):
+    # Runs inside after_commit, where no SQL may be emitted: only collect ids
+    # and leave the loading to the search.reindex job.
+    book_ids, author_ids, deleted = set(), set(), set()
+    for model, operation in changes:
+        if isinstance(model, Book):
+            if operation == 'delete':
+                deleted.add('book:%d' % model.id)
+            else:
+                book_ids.add(model.id)
+        elif isinstance(model, Author):
+            if operation == 'delete':
+                # Books of a deleted author keep its name until the next
+                # rebuild; hits are re-read from SQL, so this only affects rank.
+                deleted.add('author:%d' % model.id)
+            else:
+                author_ids.add(model.id)
+        elif isinstance(model, Association):
+            book_ids.add(int(model.books))
+    if book_ids or author_ids or deleted:
+        enqueue('search.reindex', book_ids=sorted(book_ids), author_ids=sorted(author_ids),
+                deleted=sorted(deleted))
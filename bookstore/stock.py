@@ -0,0 +1,133 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from bookstore import app, db
+from .cache import forget_later
+from .models import Book, Reservation
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, book_ids):
+        super(OutOfStock, self).__init__(book_ids)
+        self.book_ids = book_ids
+
+
+def tracked(book_ids):
+    # NULL stock means unlimited: those books need no UPDATE and no
+    # reservation.
+    if not book_ids:
+        return set()
+    return set(id for id, in db.session.query(Book.id).filter(Book.id.in_(list(book_ids)), Book.stock != None))
+
+
+def forget(book_id):
+    # Stock moves on every add to cart; bumping the catalog version for it
+    # would empty the page caches during a sale. Only the book's cached
+    # record goes, and the API serves stock without conditional GET.
+    forget_later((Book.__name__, book_id), Book.__cache_namespace__)
+
+
+def take(book_id, quantity):
+    # UPDATE ... WHERE stock >= n: the check and the decrement are one
+    # statement, so concurrent buyers can never drive stock below zero.
+    if Book.query.filter(Book.id == book_id, or_(Book.stock == None, Book.stock >= quantity)).update(
+            {Book.stock: Book.stock - quantity}, synchronize_session=False) != 1:
+        return False
+    forget(book_id)
+    return True
+
+
+def give(book_id, quantity):
+    if Book.query.filter(Book.id == book_id, Book.stock != None).update(
+            {Book.stock: Book.stock + quantity}, synchronize_session=False):
+        forget(book_id)
+
+
+def release_expired(book_id=None):
+    query = db.session.query(Reservation.id, Reservation.book_id, Reservation.quantity).filter(
+        Reservation.expires_at < datetime.utcnow())
+    if book_id is not None:
+        query = query.filter(Reservation.book_id == book_id)
+    for id, book, quantity in query.all():
+        # Only the session whose DELETE removed the row hands the stock back.
+        if Reservation.query.filter(Reservation.id == id).delete(synchronize_session=False):
+            give(book, quantity)
+
+
+_last_sweep = [0.0]
+_sweep_lock = threading.Lock()
+
+
+def sweep():
+    with _sweep_lock:
+        if time.time() - _last_sweep[0] < app.config['STOCK_SWEEP_INTERVAL']:
+            return
+        _last_sweep[0] = time.time()
+    release_expired()
+    db.session.commit()
+
+
+def reserved(cart_id, book_id):
+    return Reservation.query.filter_by(cart_id=cart_id, book_id=book_id).first()
+
+
+def reserve(cart_id, book_id, quantity):
+    # Holds `quantity` more units for the cart; False when they are not
+    # available, in which case nothing changes.
+    if not tracked([book_id]):
+        return True
+    sweep()
+    if not take(book_id, quantity):
+        release_expired(book_id)
+        if not take(book_id, quantity):
+            db.session.rollback()
+            return False
+    expires_at = datetime.utcnow() + timedelta(seconds=app.config['STOCK_RESERVATION_TTL'])
+    reservation = reserved(cart_id, book_id)
+    if reservation is None:
+        db.session.add(Reservation(cart_id=cart_id, book_id=book_id, quantity=quantity, expires_at=expires_at))
+    else:
+        reservation.quantity += quantity
+        reservation.expires_at = expires_at
+    db.session.commit()
+    return True
+
+
+def unreserve(cart_id, book_id, quantity):
+    reservation = reserved(cart_id, book_id)
+    if reservation is None:
+        return
+    quantity = min(quantity, reservation.quantity)
+    if quantity == reservation.quantity:
+        db.session.delete(reservation)
+    else:
+        reservation.quantity -= quantity
+    give(book_id, quantity)
+    db.session.commit()
+
+
+def claim(cart_id, items):
+    # Turns the cart's reservations into a sale inside the caller's
+    # transaction; lines whose reservation lapsed are taken again.
+    held = dict((book_id, (id, quantity)) for id, book_id, quantity in
+                db.session.query(Reservation.id, Reservation.book_id, Reservation.quantity)
+                .filter(Reservation.cart_id == cart_id))
+    missing = []
+    limited = tracked(set(items) - set(held))
+    for book_id, quantity in sorted(items.items()):
+        if book_id not in held and book_id not in limited:
+            continue
+        id, have = held.pop(book_id, (None, 0))
+        if id is not None and not Reservation.query.filter(Reservation.id == id).delete(synchronize_session=False):
+            have = 0
+        if have > quantity:
+            give(book_id, have - quantity)
+        elif have < quantity and not take(book_id, quantity - have):
+            missing.append(book_id)
+    for book_id, (id, quantity) in held.items():
+        if Reservation.query.filter(Reservation.id == id).delete(synchronize_session=False):
+            give(book_id, quantity)
+    if missing:
+        raise OutOfStock(missing)
@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from bookstore import app, db
+
+log = logging.getLogger(__name__)
+
+handlers = {}
+
+
+def task(name, max_attempts=5):
+    def decorator(func):
+        handlers[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+class JobQueue():
+    # Jobs live in their own SQLite file so queue churn never takes the
+    # write lock on the catalog database, and survive restarts: jobs left
+    # 'running' longer than TASK_STALE_AFTER are requeued on start, so
+    # handlers must be idempotent.
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.wakeup = threading.Event()
+        self.workers = []
+        conn = self.connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS job ('
+                     'id INTEGER PRIMARY KEY, name TEXT NOT NULL, payload TEXT NOT NULL, '
+                     'status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                     'max_attempts INTEGER NOT NULL, run_at REAL NOT NULL, '
+                     'created_at REAL NOT NULL, updated_at REAL NOT NULL, error TEXT)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_job_status_run_at ON job (status, run_at)')
+        conn.commit()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL')
+            self.local.conn = conn
+        return conn
+
+    def put(self, jobs):
+        now = time.time()
+        rows = [(name, json.dumps(payload), handlers[name][1], now, now, now)
+                for name, payload in jobs]
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany("INSERT INTO job (name, payload, status, max_attempts, run_at, created_at, updated_at) "
+                         "VALUES (?, ?, 'queued', ?, ?, ?, ?)", rows)
+        conn.execute('COMMIT')
+        self.wakeup.set()
+
+    def claim(self):
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            job = conn.execute("SELECT * FROM job WHERE status = 'queued' AND run_at <= ? "
+                               "ORDER BY run_at, id LIMIT 1", (now,)).fetchone()
+            if job is not None:
+                conn.execute("UPDATE job SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                             "WHERE id = ?", (now, job['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return job
+
+    def finish(self, job, error=None):
+        now = time.time()
+        attempts = job['attempts'] + 1
+        if error is None:
+            status, run_at = 'done', job['run_at']
+        elif attempts < job['max_attempts']:
+            status, run_at = 'queued', now + min(2 ** attempts, 300)
+        else:
+            status, run_at = 'failed', job['run_at']
+        self.connection().execute('UPDATE job SET status = ?, run_at = ?, updated_at = ?, error = ? WHERE id = ?',
+                                  (status, run_at, now, error, job['id']))
+
+    def run_one(self):
+        job = self.claim()
+        if job is None:
+            return False
+        func = handlers.get(job['name'], (None,))[0]
+        try:
+            if func is None:
+                raise LookupError('no handler for job %r' % job['name'])
+            with app.app_context():
+                try:
+                    func(**json.loads(job['payload']))
+                finally:
+                    db.session.remove()
+        except Exception:
+            log.exception('job %s (%s) failed', job['id'], job['name'])
+            self.finish(job, traceback.format_exc())
+        else:
+            self.finish(job)
+        return True
+
+    def work(self):
+        while True:
+            if not self.run_one():
+                self.wakeup.wait(app.config['TASK_POLL_INTERVAL'])
+                self.wakeup.clear()
+
+    def start(self, count):
+        if self.workers:
+            return
+        stale = time.time() - app.config['TASK_STALE_AFTER']
+        self.connection().execute("UPDATE job SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                                  (stale,))
+        for _ in range(count):
+            worker = threading.Thread(target=self.work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def retry(self, id):
+        self.connection().execute("UPDATE job SET status = 'queued', attempts = 0, run_at = ?, error = NULL "
+                                  "WHERE id = ? AND status = 'failed'", (time.time(), id))
+        self.wakeup.set()
+
+    def summary(self):
+        rows = self.connection().execute('SELECT status, count(*) FROM job GROUP BY status')
+        return dict((status, count) for status, count in rows)
+
+    def recent(self, limit=50):
+        return self.connection().execute('SELECT * FROM job ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(app.config['TASK_DATABASE'])
+    return _queue
+
+
+def run_now(name, payload):
+    # Eager mode still runs the job on its own thread, and so with its own
+    # scoped session: jobs are often queued from after_commit, where the
+    # caller's session can no longer emit SQL.
+    errors = []
+
+    def target():
+        with app.app_context():
+            try:
+                handlers[name][0](**payload)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def enqueue(name, **payload):
+    if app.config['TASK_MODE'] == 'eager':
+        run_now(name, payload)
+    else:
+        queue().put([(name, payload)])
+
+
+def enqueue_after_commit(name, **payload):
+    # Jobs describe committed state; queue them only once the session commits.
+    db.session.info.setdefault('pending_jobs', []).append((name, payload))
+
+
+@event.listens_for(Session, 'after_commit')
+def flush_jobs(session):
+    jobs = session.info.pop('pending_jobs', None)
+    if not jobs:
+        return
+    if app.config['TASK_MODE'] == 'eager':
+        for name, payload in jobs:
+            run_now(name, payload)
+    else:
+        queue().put(jobs)
+
+
+@event.listens_for(Session, 'after_rollback')
+def drop_jobs(session):
+    session.info.pop('pending_jobs', None)
+
+
+@app.before_first_request
+def start_workers():
+    if app.config['TASK_MODE'] == 'thread':
+        queue().start(app.config['TASK_WORKERS'])
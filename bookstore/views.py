@@ -1,45 +1,118 @@
-from flask import render_template, flash, redirect, session, url_for, request, g
+from flask import render_template, flash, redirect, session, url_for, request, g, abort, Markup, jsonify
 from bookstore import app, db, bootstrap, login_manager
+from werkzeug.exceptions import BadRequest
 from wtforms import ValidationError
-from .models import Book, Author, User, Role, Association, Order, admin_permission
-from .forms import LoginForm, RegistrationForm, CreateBookForm, CreateAuthorForm, DeleteBookForm, DeleteAuthorForm, UpdateBookForm, UpdateAuthorForm, AddAuthorForm, UploadUpdate
+from sqlalchemy.orm import load_only, joinedload
+from .models import Book, Author, User, Role, Association, Order, OrderStatus, admin_permission, eager
+from .forms import LoginForm, RegistrationForm, CreateBookForm, CreateAuthorForm, DeleteBookForm, DeleteAuthorForm, UpdateBookForm, UpdateAuthorForm, AddAuthorForm, UploadUpdate, WorkOrdersForm
 from flask_login import login_required, login_user, logout_user, current_user
 from .decorators import admin_required
+from .querycount import query_budget
+from .pagination import keyset_paginate, InvalidCursor
+from .images import cover_fields, send_cover, send_blob
+from .cache import remember
+from . import search as catalog_search
+from . import autocomplete
+from .choices import providers
+from . import tasks
+from .cart import Cart
+from . import archive, sales, stock
+from .httpcache import conditional
 
 
 @app.route('/')
+@conditional()
 def index():
     return render_template("index.html")
 
 
+BOOK_SORTS = {'id': Book.id, 'title': Book.book, 'price': Book.price}
+
+
+def page_args():
+    per_page = request.args.get('per_page', app.config['CATALOG_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['CATALOG_MAX_PER_PAGE']))
+    return request.args.get('after'), per_page
+
+
+def fragment(key, template, load):
+    # Catalog fragments are cached until the next catalog write commits.
+    return Markup(remember(key, lambda: render_template(template, **load())))
+
+
 @app.route('/books')
+@conditional()
 def books():
-    items = Book.query.all()
-    return render_template("books.html", items = items)
+    after, per_page = page_args()
+    sort = request.args.get('sort', 'id')
+    if sort not in BOOK_SORTS:
+        sort = 'id'
+
+    def load():
+        query = db.session.query(Book.id, Book.book, Book.price, Book.thumb_hash)
+        page = keyset_paginate(query, BOOK_SORTS[sort], Book.id, after, per_page)
+        return dict(items = page.items, page = page, sort = sort)
+    content = fragment(('books', sort, per_page, after), 'fragments/books.html', load)
+    return render_template("books.html", content = content)
 
 
 @app.route('/authors')
+@conditional()
 def authors():
-    items = Author.query.all()
-    return render_template("authors.html", items = items)
+    after, per_page = page_args()
+
+    def load():
+        query = Author.query.options(load_only('id', 'name'),
+                                     eager(Author.books).load_only('id', 'book'))
+        page = keyset_paginate(query, Author.id, Author.id, after, per_page)
+        return dict(items = page.items, page = page)
+    content = fragment(('authors', per_page, after), 'fragments/authors.html', load)
+    return render_template("authors.html", content = content)
 
 
 @app.route('/books/<book>')
+@conditional()
 def detail_book(book):
-    book = Book.query.get_or_404(book)
-    return render_template("detail_book.html", item = book)
+    load = lambda: dict(item = Book.query.options(eager(Book.authors)).get_or_404(book))
+    content = fragment(('book', book, current_user.is_authenticated),
+                       'fragments/detail_book.html', load)
+    return render_template("detail_book.html", content = content)
 
 
 @app.route('/authors/<name>')
+@conditional()
 def detail_author(name):
-    name = Author.query.get_or_404(name)
-    return render_template("detail_author.html", item = name)
+    load = lambda: dict(item = Author.query.options(eager(Author.books)).get_or_404(name))
+    content = fragment(('author', name), 'fragments/detail_author.html', load)
+    return render_template("detail_author.html", content = content)
+
+
+@app.template_filter()
+def money(value):
+    rubles, kopecks = divmod(value or 0, 100)
+    if kopecks:
+        return '%d.%02d' % (rubles, kopecks)
+    return '%d' % rubles
+
+
+@app.template_global()
+def cover_url(item, size=None):
+    digest = item.thumb_hash if size == 'thumb' else item.image_hash
+    return url_for('book_image', id=item.id, size=size, v=digest and digest[:12])
 
 
 @app.route('/store/<int:id>/image')
 def book_image(id):
-    book = Book.query.get_or_404(id)
-    return app.response_class(book.image, mimetype='application/octet-stream')
+    thumb = request.args.get('size') == 'thumb'
+    row = db.session.query(Book.image_hash, Book.thumb_hash, Book.image_type).filter(Book.id == id).first_or_404()
+    digest = row.thumb_hash if thumb else row.image_hash
+    version = request.args.get('v')
+    if digest is None:
+        image = db.session.query(Book.image).filter(Book.id == id).scalar()
+        if image is None:
+            abort(404)
+        return send_blob(image, versioned=False)
+    return send_cover(digest, row.image_type, versioned=bool(version) and digest.startswith(version))
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -48,6 +121,7 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user is not None and user.verify_password(form.password.data):
+            user.rehash_password(form.password.data)
             login_user(user, form.remember_me.data)
             return redirect(request.args.get('next') or url_for('index'))
         flash('Неверное имя или пароль')
@@ -79,7 +153,15 @@ def register():
 @login_required
 @admin_required
 def lk():
-    return render_template('lk.html')
+    return render_template('lk.html', sales=sales.dashboard())
+
+
+@app.route('/lk/sales')
+@login_required
+@admin_required
+def lk_sales():
+    return jsonify(sales.dashboard(min(request.args.get('limit', 10, type=int), 100),
+                                   request.args.get('days', 30, type=int)))
 
 
 @app.route('/lk/create', methods=['GET', 'POST'])
@@ -99,9 +181,10 @@ def lk_create():
         book = Book.create(book=bookform.name.data,
                     type=bookform.type.data,
                     description=bookform.description.data,
-                    price=bookform.price.data,
-                    authors=[bookform.authors.data],
-                    image=new_file)
+                    price=bookform.price.data * 100,
+                    stock=bookform.stock.data,
+                    authors=[Author.query.get(bookform.authors.data)],
+                    **cover_fields(new_file))
         flash('Вы создали книгу')
         return redirect(url_for('lk'))
     return render_template('lk_create.html', bookform=bookform, authorform=authorform)
@@ -124,7 +207,8 @@ def lk_update():
         book.update(book=bookform.name.data,
                     type=bookform.type.data,
                     description=bookform.description.data,
-                    price=bookform.price.data)
+                    price=bookform.price.data * 100,
+                    stock=bookform.stock.data)
         flash('Вы изменили данные в книге')
         return redirect(url_for('lk'))
 
@@ -142,12 +226,38 @@ def lk_update():
         get_file = request.files['new_image']
         file = get_file.read()
         book = Book.query.get_or_404(request.form['book_name'])
-        book.update(image=file)
+        book.update(**cover_fields(file))
         flash('Вы обновили обложку')
         return redirect(url_for('lk'))
     return render_template('lk_update.html', authorform=authorform, bookform=bookform, addform=addform, imageform=imageform)
 
 
+@app.route('/lk/jobs')
+@login_required
+@admin_required
+def lk_jobs():
+    queue = tasks.queue()
+    return render_template('lk_jobs.html', summary=queue.summary(), jobs=queue.recent())
+
+
+@app.route('/lk/jobs/<int:id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def lk_job_retry(id):
+    tasks.queue().retry(id)
+    flash('Задача %d поставлена в очередь' % id)
+    return redirect(url_for('lk_jobs'))
+
+
+@app.route('/lk/choices/<name>')
+@login_required
+@admin_required
+def lk_choices(name):
+    if name not in providers:
+        abort(404)
+    return jsonify(results=providers[name].search(request.args.get('q', '')))
+
+
 @app.route('/lk/delete', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -170,38 +280,70 @@ def lk_delete():
 
 
 @app.route('/search')
+@conditional('search')
 def search():
-    query = request.args.get('q')
-    authors = Author.query.whoosh_search(query).all()
-    books = Book.query.whoosh_search(query).all()
-    return render_template('search.html', authors=authors, books=books, query=query)
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    results = catalog_search.search(query, page, app.config['SEARCH_PER_PAGE'])
+    return render_template('search.html', results=results, query=query)
+
+
+@app.route('/autocomplete')
+def suggest():
+    limit = min(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int), 50)
+    found = autocomplete.suggest(request.args.get('q', ''), max(limit, 1))
+    results = []
+    for kind, id, label in found:
+        if kind == 'book':
+            url = url_for('detail_book', book=id)
+        else:
+            url = url_for('detail_author', name=id)
+        results.append(dict(kind=kind, id=id, label=label, url=url))
+    return jsonify(results=results)
 
 
 @app.route('/cart')
 @login_required
 def cart():
-    orders = Order.query.filter_by(user=current_user.username, status='создан').all()
-    return render_template('cart.html', orders=orders)
+    cart = Cart.current()
+    lines = cart.lines()
+    orders = (Order.query.options(joinedload(Order.book).load_only('id', 'book'))
+              .filter_by(user_id=current_user.id, status=OrderStatus.created).all())
+    total = sum(line.total for line in lines) + sum(order.price * order.quantity for order in orders)
+    return render_template('cart.html', lines=lines, orders=orders, total=total,
+                           max_quantity=app.config['CART_MAX_QUANTITY'])
+
+
+@app.route('/cart/<int:id>', methods=['POST'])
+@login_required
+def cart_update(id):
+    if not Cart.current().set(id, request.form.get('quantity', 0, type=int)):
+        flash('Столько книг нет в наличии')
+    return redirect(url_for('cart'))
+
+
+@app.route('/cart/<int:id>/remove', methods=['POST', 'GET'])
+@login_required
+def cart_remove(id):
+    Cart.current().set(id, 0)
+    return redirect(url_for('cart'))
 
 
 @app.route('/cart/in_work')
 @login_required
 def orders_in_work():
-    orders = Order.query.filter(Order.user==current_user.username, Order.status!='создан').all()
-    return render_template('orders_in_work.html', orders=orders)
+    page = archive.history(current_user.id, request.args.get('after'), app.config['ORDERS_PER_PAGE'])
+    return render_template('orders_in_work.html', orders=page.items, page=page)
 
 
 @app.route('/books/buy/<id>', methods=['POST', 'GET'])
 @login_required
 def buy_book(id):
-    book = Book.query.get_or_404(id)
-    order = Order.create(
-                user = current_user.username,
-                book = book.book,
-                email = current_user.email,
-                price = book.price,
-                number = current_user.number,
-                status = 'создан')
+    book = Book.get_cached(id)
+    if book is None:
+        abort(404)
+    if not Cart.current().add(book.id):
+        flash('Книги «%s» нет в наличии' % book.book)
     return redirect(url_for('cart'))
 
 
@@ -209,6 +351,11 @@ def buy_book(id):
 @login_required
 def delete_order(id):
     order = Order.query.get_or_404(id)
+    if order.user_id != current_user.id and not current_user.is_administrator():
+        abort(403)
+    if order.status in sales.PLACED:
+        sales.record([(order.book_id, order.price, order.quantity, order.created_at)], -1)
+        stock.give(order.book_id, order.quantity)
     order.delete()
     if current_user.role_id == admin_permission:
         return redirect(url_for('lk_orders'))
@@ -218,27 +365,44 @@ def delete_order(id):
 
 @app.route('/work', methods=['POST', 'GET'])
 @login_required
+@query_budget(app.config['CHECKOUT_QUERY_BUDGET'])
 def work():
-    orders = Order.query.filter_by(user=current_user.username).all()
-    for order in orders:
-        order.update(status='заказ в обработке')
-    return redirect(url_for('cart'))
+    try:
+        Cart.current().checkout(current_user.id)
+    except stock.OutOfStock as e:
+        titles = [title for id, title in db.session.query(Book.id, Book.book).filter(Book.id.in_(e.book_ids))]
+        flash('Нет в наличии: ' + ', '.join(titles))
+        return redirect(url_for('cart'))
+    return redirect(url_for('orders_in_work'))
 
 
 @app.route('/lk/orders', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def lk_orders():
-    orders = Order.query.filter(Order.status!='создан').all()
-    return render_template('lk_orders.html', orders=orders)
+    orders = (Order.query.options(joinedload(Order.book).load_only('id', 'book'), joinedload(Order.user))
+              .filter(Order.status!=OrderStatus.created).all())
+    return render_template('lk_orders.html', orders=orders, workform=WorkOrdersForm())
 
 
 @app.route('/lk/work/<id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def lk_work(id):
-    order = Order.query.get(id)
-    order.update(status='В работе')
+    Order.transition(OrderStatus.in_work, Order.id == id, Order.status == OrderStatus.processing)
+    return redirect(url_for('lk_orders'))
+
+
+@app.route('/lk/work', methods=['POST'])
+@login_required
+@admin_required
+def lk_work_bulk():
+    form = WorkOrdersForm()
+    ids = request.form.getlist('ids', type=int)
+    if form.validate_on_submit() and ids:
+        count = Order.transition(OrderStatus.in_work, Order.id.in_(ids),
+                                 Order.status == OrderStatus.processing)
+        flash('Заказов передано в работу: %d' % count)
     return redirect(url_for('lk_orders'))
 
 
@@ -247,6 +411,11 @@ def page_not_found(e):
     return render_template('404.html'), 404
 
 
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return BadRequest('malformed cursor')
+
+
 @app.errorhandler(500)
 def page_not_found(e):
     return render_template('500.html'), 500
@@ -0,0 +1,160 @@
+#!flask/bin/python
+import argparse
+import csv
+import json
+import mimetypes
+import os
+import shutil
+import sys
+from decimal import Decimal
+from itertools import islice
+from sqlalchemy import func
+from bookstore import create_app, db
+create_app()
+from bookstore import search
+from bookstore.cache import invalidate_later
+from bookstore.images import cover_fields, store_path
+from bookstore.models import Book, Author, Association
+
+FIELDS = ['title', 'type', 'description', 'price', 'authors', 'cover']
+
+
+def read_records(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for record in csv.DictReader(f):
+                yield record
+
+
+def to_minor_units(price):
+    if price in (None, ''):
+        return None
+    return int(Decimal(str(price)) * 100)
+
+
+def split_authors(value):
+    if isinstance(value, list):
+        names = value
+    else:
+        names = (value or '').split(';')
+    seen = []
+    for name in names:
+        name = name.strip()
+        if name and name not in seen:
+            seen.append(name)
+    return seen
+
+
+def import_catalog(path, covers=None, batch_size=1000):
+    # Ids are allocated here so that book, author and association rows can
+    # all go out as executemany batches; run one import at a time.
+    next_book = (db.session.query(func.max(Book.id)).scalar() or 0) + 1
+    next_author = (db.session.query(func.max(Author.id)).scalar() or 0) + 1
+    authors = dict(db.session.query(Author.name, Author.id))
+    records = read_records(path)
+    total = 0
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        books, new_authors, links = [], [], []
+        for record in batch:
+            row = dict(id=next_book,
+                       book=record['title'],
+                       type=record.get('type'),
+                       description=record.get('description'),
+                       price=to_minor_units(record.get('price')),
+                       image=None, image_hash=None, thumb_hash=None, image_type=None)
+            if covers and record.get('cover'):
+                with open(os.path.join(covers, record['cover']), 'rb') as f:
+                    row.update(cover_fields(f.read()))
+            for name in split_authors(record.get('authors')):
+                if name not in authors:
+                    authors[name] = next_author
+                    new_authors.append(dict(id=next_author, name=name))
+                    next_author += 1
+                links.append(dict(books=next_book, authors=authors[name]))
+            books.append(row)
+            next_book += 1
+        if new_authors:
+            db.session.execute(Author.__table__.insert(), new_authors)
+        db.session.execute(Book.__table__.insert(), books)
+        if links:
+            db.session.execute(Association.__table__.insert(), links)
+        invalidate_later('catalog')
+        db.session.commit()
+        total += len(books)
+        print('Imported books: %d' % total)
+    # Core inserts bypass models_committed, so the index is rebuilt once.
+    search.rebuild()
+    return total
+
+
+def export_rows(batch_size=1000):
+    names = func.group_concat(Author.name, ';')
+    query = (db.session.query(Book.id, Book.book, Book.type, Book.description, Book.price,
+                              Book.image_hash, Book.image_type, names)
+             .outerjoin(Association, Association.books == Book.id)
+             .outerjoin(Author, Author.id == Association.authors)
+             .group_by(Book.id)
+             .order_by(Book.id))
+    last_id = 0
+    while True:
+        rows = query.filter(Book.id > last_id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            yield row
+        last_id = rows[-1][0]
+
+
+def export_catalog(path, covers=None, batch_size=1000):
+    if covers and not os.path.isdir(covers):
+        os.makedirs(covers)
+    total = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = None if path.endswith('.jsonl') else csv.DictWriter(f, FIELDS)
+        if writer:
+            writer.writeheader()
+        for id, title, type, description, price, image_hash, image_type, authors in export_rows(batch_size):
+            cover = ''
+            if covers and image_hash:
+                cover = image_hash + (mimetypes.guess_extension(image_type or '') or '')
+                shutil.copyfile(store_path(image_hash), os.path.join(covers, cover))
+            record = dict(title=title, type=type, description=description,
+                          price='%d.%02d' % divmod(price, 100) if price is not None else '',
+                          authors=authors or '', cover=cover)
+            if writer:
+                writer.writerow(record)
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            total += 1
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk catalog import and export (CSV or JSONL).')
+    subparsers = parser.add_subparsers(dest='command')
+    for name in ('import', 'export'):
+        command = subparsers.add_parser(name)
+        command.add_argument('path')
+        command.add_argument('--covers', help='directory with cover image files')
+        command.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+    if args.command == 'import':
+        total = import_catalog(args.path, args.covers, args.batch_size)
+    elif args.command == 'export':
+        total = export_catalog(args.path, args.covers, args.batch_size)
+    else:
+        parser.print_help()
+        return 1
+    print('Done: %d books' % total)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,157 @@
 import os
+import tempfile
 
 CSRF_ENABLED = True
 
 
 SECRET_KEY = 'secret'
 
-
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
+# 'development', 'testing' or 'production', set from ENVIRONMENTS below;
+# DATABASE_URL points at a server database instead
+DATABASE_PROFILE = 'development'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'app.db'))
 SQLALCHEMY_MIGRATE_REPO = os.path.join(basedir, 'db_repository')
 WHOOSH_BASE = os.path.join(basedir, 'whoosh_index')
+IMAGE_STORE = os.path.join(basedir, 'covers')
+
+# 'whoosh' or 'fts5' (SQLite full-text search, no Whoosh needed)
+SEARCH_BACKEND = 'whoosh'
+SEARCH_PER_PAGE = 20
+SQLALCHEMY_TRACK_MODIFICATIONS = True
+
+CATALOG_PER_PAGE = 24
+CATALOG_MAX_PER_PAGE = 100
+
+# Max ids per batch fetch (?ids=1,2,3) in the JSON API under /api/v1
+API_MAX_BATCH = 100
+
+# Conditional GET for catalog pages, keyed on the catalog cache version.
+# None enables it only with a shared (redis) CACHE_BACKEND; True also
+# trusts the in-process LRU, which is only right for a single worker.
+HTTP_CACHE_ENABLED = None
+# gzip (and brotli when installed) for text responses; run assets.py to
+# precompress static files
+COMPRESS_ENABLED = True
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+# For fingerprinted static URLs (?v=<content hash>)
+STATIC_MAX_AGE = 60 * 60 * 24 * 365
+
+THUMBNAIL_SIZE = (240, 320)
+IMAGE_MAX_AGE = 60 * 60 * 24 * 365
+USE_X_SENDFILE = False
+
+# 'selectin' or 'joined'
+RELATIONSHIP_LOADING = 'selectin'
+
+# Prometheus text at /metrics; ?profile=1 (or =text) on any page for admins
+METRICS_ENABLED = os.environ.get('BOOKSTORE_METRICS') == '1'
+PROFILING_ENABLED = False
+PROFILE_DIR = os.path.join(basedir, 'profiles')
+
+# Max SQL queries per request, enforced in debug and testing mode
+QUERY_BUDGET = 10
+# Checkout claims stock and updates the sales totals in the same request
+CHECKOUT_QUERY_BUDGET = 20
+
+# 'lru' (in-process) or 'redis'
+CACHE_BACKEND = 'lru'
+CACHE_REDIS_URL = 'redis://localhost:6379/0'
+CACHE_MAX_ENTRIES = 10000
+CACHE_DEFAULT_TTL = 300
+
+# Seconds a logged-in user's identity is served from the cache
+USER_CACHE_TTL = 60
+
+# Werkzeug hash spec including the iteration count; hashes made with any
+# other spec are upgraded on the user's next login
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:50000'
+PASSWORD_SALT_LENGTH = 8
+
+# Server-side carts, keyed by a random id in the session cookie
+CART_BACKEND = 'lru'
+CART_REDIS_URL = 'redis://localhost:6379/1'
+CART_MAX_ENTRIES = 100000
+CART_DEFAULT_TTL = 7 * 24 * 3600
+CART_MAX_QUANTITY = 99
+# Seconds cart items hold stock before it returns to sale
+STOCK_RESERVATION_TTL = 15 * 60
+STOCK_SWEEP_INTERVAL = 60
+
+AUTOCOMPLETE_MAX_ENTRIES = 2000000
+AUTOCOMPLETE_MAX_AGE = 600
+AUTOCOMPLETE_LIMIT = 10
+
+# Admin dropdowns with more entries switch to search-as-you-type
+CHOICES_INLINE_LIMIT = 1000
+
+SQLITE_PRAGMAS = {'busy_timeout': 5000}
+SQLITE_POOL_SIZE = None
+
+# Orders in the last status longer than ARCHIVE_AFTER_DAYS move to the
+# archive (db_archive.py); with SQLite it is a separate, attached file
+ARCHIVE_DATABASE = os.path.join(basedir, 'archive.db')
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+ORDERS_PER_PAGE = 20
+
+# 'thread' runs jobs on TASK_WORKERS background threads, 'eager' runs them
+# inline (tests, scripts)
+TASK_MODE = 'thread'
+TASK_WORKERS = 2
+TASK_DATABASE = os.path.join(basedir, 'tasks.db')
+TASK_POLL_INTERVAL = 1.0
+TASK_STALE_AFTER = 600
+
+
+def production():
+    # WAL lets readers run alongside the single writer; NORMAL sync is
+    # durable in WAL mode except for the last commits on power loss.
+    settings = {
+        'DATABASE_PROFILE': 'production',
+        'SQLITE_PRAGMAS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,
+        },
+        'SQLITE_POOL_SIZE': int(os.environ.get('SQLITE_POOL_SIZE', 8)),
+        'SQLITE_MAX_OVERFLOW': 4,
+    }
+    if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        settings.update(SQLALCHEMY_POOL_SIZE=int(os.environ.get('DATABASE_POOL_SIZE', 10)),
+                        SQLALCHEMY_MAX_OVERFLOW=10,
+                        SQLALCHEMY_POOL_RECYCLE=1800)
+    return settings
+
+
+def testing():
+    # Every test app gets its own throwaway database, index and stores.
+    workdir = tempfile.mkdtemp(prefix='bookstore-test-')
+    return {
+        'DATABASE_PROFILE': 'testing',
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'TASK_MODE': 'eager',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'app.db'),
+        'WHOOSH_BASE': os.path.join(workdir, 'whoosh_index'),
+        'IMAGE_STORE': os.path.join(workdir, 'covers'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        'ARCHIVE_DATABASE': os.path.join(workdir, 'archive.db'),
+        'TASK_DATABASE': os.path.join(workdir, 'tasks.db'),
+        'TEST_DIR': workdir,
+    }
+
 
-MAX_SEARCH_RESULTS = 50
+# Picked by create_app() from its argument or BOOKSTORE_ENV and applied on
+# top of this module; callables are evaluated only for the chosen one
+ENVIRONMENTS = {
+    'development': {'DATABASE_PROFILE': 'development'},
+    'testing': testing,
+    'production': production,
+}
@@ -0,0 +1,7 @@
+#!flask/bin/python
+import sys
+from bookstore import create_app
+create_app()
+from bookstore import archive
+days = int(sys.argv[1]) if len(sys.argv) > 1 else None
+print('Orders archived: ' + str(archive.archive(days)))
@@ -0,0 +1,13 @@
+#!flask/bin/python
+from sqlalchemy.orm import undefer
+from bookstore import create_app, db
+create_app()
+from bookstore.models import Book
+from bookstore.images import cover_fields
+ids = [id for id, in db.session.query(Book.id).filter(Book.image_hash == None, Book.image != None)]
+for id in ids:
+    book = Book.query.options(undefer('image')).get(id)
+    book.update(commit=False, **cover_fields(book.image))
+    db.session.commit()
+    db.session.expunge_all()
+print('Covers moved to the image store: ' + str(len(ids)))
@@ -1,9 +1,12 @@
 #!flask/bin/python
 import imp
 from migrate.versioning import api
-from bookstore import db
+from bookstore import create_app, db
+from bookstore.migrations import before_upgrade
 from config import SQLALCHEMY_DATABASE_URI
 from config import SQLALCHEMY_MIGRATE_REPO
+create_app()
+before_upgrade(db.engine)
 migration = SQLALCHEMY_MIGRATE_REPO + '/versions/%03d_migration.py' % (api.db_version(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO) + 1)
 tmp_module = imp.new_module('old_model')
 old_model = api.create_model(SQLALCHEMY_DATABASE_URI, SQLALCHEMY_MIGRATE_REPO)
@@ -0,0 +1,6 @@
+#!flask/bin/python
+from bookstore import create_app
+create_app()
+from bookstore import search
+search.rebuild()
+print('Search index rebuilt with backend: ' + search.backend().__class__.__name__)
@@ -0,0 +1,6 @@
+#!flask/bin/python
+from bookstore import create_app
+create_app()
+from bookstore import sales
+sales.rebuild()
+print('Sales summaries rebuilt')
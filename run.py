@@ -1,4 +1,4 @@
 #!flask/bin/python
-from bookstore import app
+from bookstore import create_app
 
-app.run(debug=True)
+create_app().run(debug=True)
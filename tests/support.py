@@ -0,0 +1,27 @@
+import atexit
+import os
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bookstore import create_app, db
+
+# One app per test run: caches, the search backend and the task queue are
+# module globals bound to the first configuration.
+app = create_app('testing', STOCK_SWEEP_INTERVAL=0)
+atexit.register(shutil.rmtree, app.config['TEST_DIR'], True)
+
+
+class AppTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
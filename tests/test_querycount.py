@@ -0,0 +1,57 @@
+import unittest
+
+from support import AppTestCase
+from bookstore import app, db, search
+from bookstore.models import Author, Book
+from bookstore.querycount import QueryBudgetExceeded
+
+
+class QueryBudgetTest(AppTestCase):
+    # Page sizes are well above one, so an N+1 in any of these views blows
+    # the budget.
+
+    def setUp(self):
+        super(QueryBudgetTest, self).setUp()
+        search.backend().clear()
+        authors = [Author(name='Author %d' % i) for i in range(5)]
+        books = []
+        for i in range(30):
+            book = Book(book='Novel %d' % i, type='novel', description='Story number %d' % i, price=100 * i)
+            book.authors = [authors[i % 5], authors[(i + 1) % 5]]
+            books.append(book)
+        db.session.add_all(authors + books)
+        db.session.commit()
+        self.book_id, self.author_id = books[0].id, authors[0].id
+        db.session.remove()
+        self.client = app.test_client()
+
+    def assertWithinBudget(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(int(response.headers['X-Query-Count']), app.config['QUERY_BUDGET'], url)
+
+    def test_catalog_pages(self):
+        for url in ('/books', '/books?sort=price', '/authors',
+                    '/books/%d' % self.book_id, '/authors/%d' % self.author_id):
+            self.assertWithinBudget(url)
+
+    def test_search(self):
+        self.assertWithinBudget('/search?q=novel')
+
+    def test_api_listings(self):
+        for url in ('/api/v1/books', '/api/v1/books?fields=title,authors,stock', '/api/v1/authors',
+                    '/api/v1/books?ids=%d,%d' % (self.book_id, self.book_id + 1), '/api/v1/search?q=novel'):
+            self.assertWithinBudget(url)
+
+    def test_exceeding_the_budget_fails(self):
+        budget = app.config['QUERY_BUDGET']
+        app.config['QUERY_BUDGET'] = 0
+        try:
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/authors')
+        finally:
+            app.config['QUERY_BUDGET'] = budget
+
+
+if __name__ == '__main__':
+    unittest.main()
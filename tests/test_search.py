@@ -0,0 +1,30 @@
+import unittest
+
+from support import AppTestCase
+from bookstore import app, search
+from bookstore.models import Book
+
+
+class SearchTest(AppTestCase):
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        search.backend().clear()
+        self.client = app.test_client()
+
+    def test_search_after_a_catalog_write(self):
+        Book.create(book='Anna Karenina', type='novel', description='', price=10000)
+        response = self.client.get('/search?q=Karenina')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Anna Karenina', response.get_data(as_text=True))
+        # The thread's searcher is now stale and has to be refreshed.
+        Book.create(book='War and Peace', type='novel', description='', price=10000)
+        response = self.client.get('/search?q=Peace')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('War and Peace', response.get_data(as_text=True))
+        response = self.client.get('/search?q=Karenina')
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
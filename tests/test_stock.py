@@ -0,0 +1,122 @@
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from support import AppTestCase
+from bookstore import app, db, stock
+from bookstore.models import Book, Order, Reservation, User
+
+
+class StockTest(AppTestCase):
+
+    def book(self, stock):
+        return Book.create(book='Flash sale', type='novel', description='', price=10000, stock=stock).id
+
+    def left(self, book_id):
+        return db.session.query(Book.stock).filter(Book.id == book_id).scalar()
+
+    def test_reservations_never_exceed_stock(self):
+        book_id = self.book(3)
+        self.assertTrue(stock.reserve('a', book_id, 2))
+        self.assertFalse(stock.reserve('b', book_id, 2))
+        self.assertTrue(stock.reserve('b', book_id, 1))
+        self.assertFalse(stock.reserve('c', book_id, 1))
+        self.assertEqual(self.left(book_id), 0)
+
+    def test_claim_keeps_held_units_and_refuses_the_rest(self):
+        book_id = self.book(2)
+        self.assertTrue(stock.reserve('a', book_id, 2))
+        with self.assertRaises(stock.OutOfStock) as raised:
+            stock.claim('b', {book_id: 1})
+        self.assertEqual(raised.exception.book_ids, [book_id])
+        db.session.rollback()
+        stock.claim('a', {book_id: 2})
+        db.session.commit()
+        self.assertEqual(self.left(book_id), 0)
+        self.assertEqual(Reservation.query.count(), 0)
+
+    def test_expired_reservation_returns_stock(self):
+        book_id = self.book(1)
+        self.assertTrue(stock.reserve('a', book_id, 1))
+        Reservation.query.update({Reservation.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        self.assertTrue(stock.reserve('b', book_id, 1))
+        self.assertEqual(self.left(book_id), 0)
+        with self.assertRaises(stock.OutOfStock):
+            stock.claim('a', {book_id: 1})
+        db.session.rollback()
+
+    def test_unlimited_stock_is_not_reserved(self):
+        book_id = self.book(None)
+        self.assertTrue(stock.reserve('a', book_id, 5))
+        stock.claim('a', {book_id: 5})
+        db.session.commit()
+        self.assertIsNone(self.left(book_id))
+        self.assertEqual(Reservation.query.count(), 0)
+
+
+
+class ContentionTest(AppTestCase):
+    # Buyers race for the same book through the real views, each with its own
+    # client, thread and scoped session against the one file database.
+    buyers = 8
+    attempts = 6
+    initial = 20
+
+    def setUp(self):
+        super(ContentionTest, self).setUp()
+        self.budget = app.config['QUERY_BUDGET']
+        app.config['QUERY_BUDGET'] = None
+        self.book_id = Book.create(book='Flash sale', type='novel', description='', price=10000,
+                                   stock=self.initial).id
+        self.accounts = []
+        for i in range(self.buyers):
+            User.create(username='buyer%d' % i, email='buyer%d@example.com' % i, password='buyer', number='0')
+            self.accounts.append(('buyer%d' % i, 'buyer%d@example.com' % i))
+        db.session.remove()
+
+    def tearDown(self):
+        app.config['QUERY_BUDGET'] = self.budget
+        super(ContentionTest, self).tearDown()
+
+    def buyer(self, account, errors):
+        client = app.test_client()
+        client.post('/login', data=dict(name=account[0], email=account[1], password='buyer'))
+        for _ in range(self.attempts):
+            for url in ('/books/buy/%d' % self.book_id, '/work'):
+                try:
+                    response = client.get(url)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if response.status_code >= 500:
+                    errors.append(response.status_code)
+        # The last buy of each buyer stays in the cart as a reservation.
+        try:
+            client.get('/books/buy/%d' % self.book_id)
+        except Exception as e:
+            errors.append(e)
+
+    def test_concurrent_buyers_never_oversell(self):
+        errors = []
+        threads = [threading.Thread(target=self.buyer, args=(account, errors)) for account in self.accounts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        db.session.remove()
+        remaining = db.session.query(Book.stock).filter(Book.id == self.book_id).scalar()
+        sold = db.session.query(db.func.coalesce(db.func.sum(Order.quantity), 0)).filter(
+            Order.book_id == self.book_id).scalar()
+        held = db.session.query(db.func.coalesce(db.func.sum(Reservation.quantity), 0)).filter(
+            Reservation.book_id == self.book_id).scalar()
+        self.assertGreaterEqual(remaining, 0)
+        self.assertLessEqual(sold, self.initial)
+        self.assertEqual(sold + held + remaining, self.initial)
+        self.assertGreater(sold, 0)
+        self.assertEqual(remaining, 0, 'demand exceeds stock, so everything is sold or held')
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
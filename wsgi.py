@@ -0,0 +1,3 @@
+from bookstore import create_app
+
+application = create_app()